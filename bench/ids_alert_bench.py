@@ -0,0 +1,337 @@
+#!/usr/local/bin/python3
+"""
+IDS Alert Benchmark
+
+Generates synthetic Suricata eve.json logs and drives ids_alert.main()
+against them with temporary state files and a stub SMTP sink. Reports
+throughput, peak memory and per-stage timings for each scenario, and
+compares the results with stored baselines to catch regressions.
+
+Usage:
+    ids_alert_bench.py [options]                 - Run and compare with baseline
+    ids_alert_bench.py --save-baseline [options] - Run and store as new baseline
+
+Options:
+    --events N[,N...]        eve.json sizes in events (default 10000,100000)
+    --alert-ratio R          fraction of events that are alerts (default 0.05)
+    --signatures N           distinct alert signatures (default 50)
+    --rules N                ignore/digest patterns in the config (default 10)
+    --digest-signatures N    signatures pre-seeded in the digest (default 0)
+    --baseline FILE          baseline file (default bench/ids_alert_baseline.json)
+    --repeat N               runs per scenario, the fastest is kept (default 3)
+    --tolerance PCT          allowed regression in percent (default 20)
+"""
+
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import smtplib
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src', 'opnsense', 'scripts', 'OPNsense', 'CustomConfig'
+)
+sys.path.insert(0, SCRIPT_DIR)
+
+import ids_alert
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ids_alert_baseline.json')
+STAGES = ('read', 'decode', 'filter', 'group', 'format')
+
+EVENT_TYPES = ('flow', 'dns', 'http', 'tls', 'fileinfo', 'netflow')
+CATEGORIES = ('Attempted Information Leak', 'Misc activity', 'Potentially Bad Traffic',
+              'Attempted Administrator Privilege Gain', 'Network Scan')
+
+
+class SinkSMTP:
+    """Stand-in for smtplib.SMTP that accepts and counts every message."""
+
+    sent = 0
+
+    def __init__(self, host='', port=0, timeout=None):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        SinkSMTP.sent += 1
+
+    def quit(self):
+        pass
+
+
+def generate_eve(path, events, alert_ratio, signatures, seed=1):
+    """Write a synthetic eve.json with a realistic mix of event types."""
+    rnd = random.Random(seed)
+    sigs = [f'ET SCAN Synthetic signature {i}' for i in range(signatures)]
+    sources = [f'198.51.{i // 256}.{i % 256}' for i in range(500)]
+    base = time.time() - events
+
+    with open(path, 'w') as f:
+        for i in range(events):
+            ts = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(base + i)) + '.000000+0000'
+            event = {
+                'timestamp': ts,
+                'flow_id': rnd.getrandbits(48),
+                'in_iface': 'igb0',
+                'src_ip': rnd.choice(sources),
+                'src_port': rnd.randint(1024, 65535),
+                'dest_ip': '192.0.2.10',
+                'dest_port': rnd.choice((22, 23, 80, 443, 445, 3389, 8080)),
+                'proto': 'TCP',
+            }
+            if rnd.random() < alert_ratio:
+                event['event_type'] = 'alert'
+                event['alert'] = {
+                    'action': 'allowed',
+                    'gid': 1,
+                    'signature_id': 2000000 + rnd.randrange(signatures),
+                    'rev': 1,
+                    'signature': rnd.choice(sigs),
+                    'category': rnd.choice(CATEGORIES),
+                    'severity': rnd.randint(1, 3),
+                }
+            else:
+                event['event_type'] = rnd.choice(EVENT_TYPES)
+                event[event['event_type']] = {'pkts_toserver': rnd.randint(1, 50),
+                                              'bytes_toserver': rnd.randint(60, 9000)}
+            f.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+
+def write_config(path, rules):
+    """Write an ids_alert.conf with the requested number of patterns."""
+    half = max(1, rules // 2)
+    ignore = ','.join(f'Synthetic signature {i}$' for i in range(0, half))
+    digest = ','.join(f'Synthetic signature {i}$' for i in range(half, rules)) or 'never-matches'
+    with open(path, 'w') as f:
+        f.write('[smtp]\nserver = 127.0.0.1\nport = 25\nfrom = ids@localhost\n'
+                'to = root@localhost\nuser = bench\npassword = bench\n\n')
+        f.write(f'[ignore]\nsignatures = {ignore}\n\n')
+        f.write(f'[digest]\nsignatures = {digest}\ndest_ports = 23\n')
+
+
+def seed_digest(path, signatures):
+    """Pre-populate the digest with aggregates for the given signature count."""
+    digest = ids_alert.new_digest(time.strftime('%Y-%m-%d'))
+    for i in range(signatures):
+        ids_alert.add_to_digest(digest, {
+            'alert': {'signature': f'Seeded signature {i}'},
+            'src_ip': f'203.0.113.{i % 256}',
+            'dest_port': 23,
+        })
+    with open(path, 'w') as f:
+        json.dump(digest, f)
+
+
+def timed(timings, stage, func):
+    """Wrap func so its wall time accumulates into timings[stage]."""
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[stage] += time.perf_counter() - start
+    return wrapper
+
+
+def instrument(timings):
+    """Patch ids_alert so each pipeline stage is timed."""
+    class TimedJson:
+        loads = staticmethod(timed(timings, 'decode', json.loads))
+        load = staticmethod(json.load)
+        dump = staticmethod(json.dump)
+
+    ids_alert.json = TimedJson
+    ids_alert.read_events = timed(timings, 'read', ids_alert.read_events)
+    for name in ('should_ignore', 'should_digest', 'add_to_digest'):
+        setattr(ids_alert, name, timed(timings, 'filter', getattr(ids_alert, name)))
+    ids_alert.correlate = timed(timings, 'group', ids_alert.correlate)
+    ids_alert.format_alert = timed(timings, 'format', ids_alert.format_alert)
+    smtplib.SMTP = SinkSMTP
+
+
+def run_scenario(workdir, events, results):
+    """Run main() once in a child process and report its measurements."""
+    timings = dict.fromkeys(STAGES, 0.0)
+    instrument(timings)
+
+    ids_alert.CONFIG_FILE = os.path.join(workdir, 'ids_alert.conf')
+    ids_alert.EVE_LOG = os.path.join(workdir, 'eve.json')
+    ids_alert.STATE_FILE = os.path.join(workdir, 'state')
+    ids_alert.DIGEST_FILE = os.path.join(workdir, 'digest.json')
+    ids_alert.SPOOL_DIR = os.path.join(workdir, 'spool')
+    ids_alert.SPOOL_BACKOFF_FILE = os.path.join(ids_alert.SPOOL_DIR, 'backoff.json')
+    ids_alert.CORRELATION_FILE = os.path.join(workdir, 'correlation.json')
+    ids_alert.HISTORY_DB = os.path.join(workdir, 'history.db')
+
+    sys.stdout = open(os.devnull, 'w')
+    start = time.perf_counter()
+    ids_alert.main()
+    elapsed = time.perf_counter() - start
+    sys.stdout = sys.__stdout__
+
+    # read_events() includes decoding and filtering, report only its own share
+    timings['read'] -= timings['decode'] + timings['filter']
+
+    results.put({
+        'events': events,
+        'bytes': os.path.getsize(ids_alert.EVE_LOG),
+        'seconds': elapsed,
+        'events_per_sec': events / elapsed if elapsed else 0,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'stages': timings,
+        'emails': SinkSMTP.sent,
+    })
+
+
+def run(args):
+    """Run every scenario and return a dict of results keyed by scenario name."""
+    results = {}
+    for events in args['events']:
+        workdir = tempfile.mkdtemp(prefix='ids_alert_bench.')
+        try:
+            generate_eve(os.path.join(workdir, 'eve.json'), events,
+                         args['alert_ratio'], args['signatures'])
+            write_config(os.path.join(workdir, 'ids_alert.conf'), args['rules'])
+
+            result = None
+            for _ in range(args['repeat']):
+                # Every repetition starts from fresh state
+                for name in ('state', 'digest.json', 'correlation.json'):
+                    if os.path.exists(os.path.join(workdir, name)):
+                        os.remove(os.path.join(workdir, name))
+                shutil.rmtree(os.path.join(workdir, 'spool'), ignore_errors=True)
+                if args['digest_signatures']:
+                    seed_digest(os.path.join(workdir, 'digest.json'), args['digest_signatures'])
+
+                queue = multiprocessing.Queue()
+                proc = multiprocessing.Process(target=run_scenario, args=(workdir, events, queue))
+                proc.start()
+                attempt = queue.get()
+                proc.join()
+                if result is None or attempt['seconds'] < result['seconds']:
+                    result = attempt
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        name = (f"events={events},alerts={args['alert_ratio']},sigs={args['signatures']},"
+                f"rules={args['rules']},digest={args['digest_signatures']}")
+        results[name] = result
+        report(name, result)
+    return results
+
+
+def report(name, result):
+    """Print one scenario's measurements."""
+    print(f'{name}')
+    print(f"  {result['events_per_sec']:12.0f} events/s  "
+          f"{result['bytes'] / result['seconds'] / 1048576:8.1f} MB/s  "
+          f"peak RSS {result['peak_rss_kb'] / 1024:.1f} MB  "
+          f"({result['emails']} emails)")
+    print('  ' + '  '.join(f'{s} {result["stages"][s] * 1000:.1f}ms' for s in STAGES))
+
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline, return the list of regressions."""
+    regressions = []
+    limit = tolerance / 100.0
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f'No baseline for {name}')
+            continue
+        if result['events_per_sec'] < base['events_per_sec'] * (1 - limit):
+            regressions.append(f"{name}: throughput {result['events_per_sec']:.0f} "
+                               f"< baseline {base['events_per_sec']:.0f} events/s")
+        if result['peak_rss_kb'] > base['peak_rss_kb'] * (1 + limit):
+            regressions.append(f"{name}: peak RSS {result['peak_rss_kb']} "
+                               f"> baseline {base['peak_rss_kb']} KB")
+    return regressions
+
+
+def parse_args(argv):
+    """Parse command line options into a dict."""
+    args = {
+        'events': [10000, 100000],
+        'alert_ratio': 0.05,
+        'signatures': 50,
+        'rules': 10,
+        'digest_signatures': 0,
+        'baseline': DEFAULT_BASELINE,
+        'repeat': 3,
+        'tolerance': 20.0,
+        'save': False,
+    }
+    i = 0
+    while i < len(argv):
+        opt = argv[i]
+        if opt == '--save-baseline':
+            args['save'] = True
+            i += 1
+            continue
+        if i + 1 >= len(argv):
+            print(__doc__)
+            sys.exit(1)
+        value = argv[i + 1]
+        if opt == '--events':
+            args['events'] = [int(v) for v in value.split(',')]
+        elif opt == '--alert-ratio':
+            args['alert_ratio'] = float(value)
+        elif opt == '--signatures':
+            args['signatures'] = int(value)
+        elif opt == '--rules':
+            args['rules'] = int(value)
+        elif opt == '--digest-signatures':
+            args['digest_signatures'] = int(value)
+        elif opt == '--baseline':
+            args['baseline'] = value
+        elif opt == '--repeat':
+            args['repeat'] = max(1, int(value))
+        elif opt == '--tolerance':
+            args['tolerance'] = float(value)
+        else:
+            print(f'Unknown option: {opt}')
+            print(__doc__)
+            sys.exit(1)
+        i += 2
+    return args
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    results = run(args)
+
+    try:
+        with open(args['baseline'], 'r') as f:
+            baseline = json.load(f)
+    except:
+        baseline = {}
+
+    if args['save']:
+        baseline.update(results)
+        with open(args['baseline'], 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args['baseline']}")
+        return
+
+    regressions = compare(results, baseline, args['tolerance'])
+    if regressions:
+        print('\nPerformance regressions:')
+        for r in regressions:
+            print(f'  {r}')
+        sys.exit(1)
+    print('\nNo regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+#!/usr/local/bin/python3
+"""
+VPN Bypass Latency Harness
+
+Measures how long it takes from a DNS answer appearing on the wire until
+its address reaches the customconfig_vpnbypass PF table, i.e. how long a
+LAN client's first connection still goes through the VPN.
+
+A stand-in DNS server emits answers (as tcpdump -v text, the same thing
+the sniffer reads) into a FIFO at a configurable rate. The real sniffer
+loop reads them through a fake tcpdump and hands new addresses to a
+recording fake pfctl. Answers the pipeline cannot absorb are dropped at
+the FIFO, like the kernel drops packets when tcpdump falls behind.
+
+Usage:
+    vpnbypass_latency_bench.py [options]
+
+Options:
+    --rates N[,N...]   answers per second per load step (default 50,100,200,500,1000)
+    --duration S       seconds per load step (default 5)
+    --new-ratio R      fraction of answers for a not yet seen name (default 0.1)
+    --drain S          seconds to wait for stragglers after each step (default 3)
+"""
+
+import fcntl
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+SCRIPT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..', 'src', 'opnsense', 'scripts', 'OPNsense', 'CustomConfig'
+)
+sys.path.insert(0, SCRIPT_DIR)
+
+import vpnbypass_sniffer
+import vpnbypass_sync
+
+BASE_DOMAIN = 'bench.example'
+
+
+class Recorder(threading.Thread):
+    """Tail the fake pfctl's record file and timestamp every address added."""
+
+    def __init__(self, path):
+        super().__init__(daemon=True)
+        self.path = path
+        self.seen = {}
+        self.stop = False
+
+    def run(self):
+        while not os.path.exists(self.path) and not self.stop:
+            time.sleep(0.001)
+        with open(self.path, 'r') as f:
+            buf = ''
+            while not self.stop:
+                data = f.read()
+                if not data:
+                    time.sleep(0.001)
+                    continue
+                now = time.perf_counter()
+                buf += data
+                *lines, buf = buf.split('\n')
+                for ip in lines:
+                    self.seen.setdefault(ip, now)
+
+
+def write_fakes(workdir):
+    """Create the fake tcpdump (reads the FIFO) and recording fake pfctl."""
+    fifo = os.path.join(workdir, 'answers.fifo')
+    record = os.path.join(workdir, 'pfctl.record')
+    os.mkfifo(fifo)
+
+    tcpdump = os.path.join(workdir, 'tcpdump')
+    with open(tcpdump, 'w') as f:
+        f.write(f'#!/bin/sh\nexec cat "{fifo}"\n')
+    os.chmod(tcpdump, 0o755)
+
+    # Arguments are: -t <table> -T add <ip>, or -t <table> -T add -f <file>
+    pfctl = os.path.join(workdir, 'pfctl')
+    with open(pfctl, 'w') as f:
+        f.write('#!/bin/sh\n'
+                'if [ "$5" = "-f" ]; then\n'
+                f'    n=$(wc -l < "$6"); cat "$6" >> "{record}"\n'
+                '    echo "$n/$n addresses added." >&2\n'
+                'else\n'
+                f'    printf "%s\\n" "$5" >> "{record}"\n'
+                '    echo "1/1 addresses added." >&2\n'
+                'fi\n')
+    os.chmod(pfctl, 0o755)
+
+    return fifo, record, tcpdump, pfctl
+
+
+def answer_line(name, ip, qid):
+    """Format one DNS response the way tcpdump -l -n -v prints it, spread over 200 clients."""
+    client = f'192.168.1.{10 + qid % 200}'
+    return (f'192.168.1.1.53 > {client}.{40000 + qid % 20000}: {qid} 1/0/0 '
+            f'{name}. A {ip} (64)\n')
+
+
+def emit(fifo_fd, rate, duration, new_ratio, counter, names):
+    """
+    Write answers at the given rate, returning {ip: emit time} and drops.
+
+    Every answer carries a fresh address so its arrival in the table can
+    be matched; a write that would block counts as a dropped packet.
+    """
+    emitted = {}
+    dropped = 0
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    total = int(rate * duration)
+
+    for i in range(total):
+        target = start + i * interval
+        delay = target - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        n = counter[0]
+        counter[0] += 1
+        ip = f'10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}'
+        if not names or random.random() < new_ratio:
+            names.append(f'host{n}.{BASE_DOMAIN}')
+        name = random.choice(names)
+
+        try:
+            os.write(fifo_fd, answer_line(name, ip, n).encode())
+            emitted[ip] = time.perf_counter()
+        except BlockingIOError:
+            dropped += 1
+
+    return emitted, dropped
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    k = max(0, min(len(values) - 1, int(round(pct / 100.0 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+def parse_args(argv):
+    """Parse command line options into a dict."""
+    args = {'rates': [50, 100, 200, 500, 1000], 'duration': 5.0,
+            'new_ratio': 0.1, 'drain': 3.0}
+    i = 0
+    while i < len(argv):
+        if i + 1 >= len(argv):
+            print(__doc__)
+            sys.exit(1)
+        opt, value = argv[i], argv[i + 1]
+        if opt == '--rates':
+            args['rates'] = [int(v) for v in value.split(',')]
+        elif opt == '--duration':
+            args['duration'] = float(value)
+        elif opt == '--new-ratio':
+            args['new_ratio'] = float(value)
+        elif opt == '--drain':
+            args['drain'] = float(value)
+        else:
+            print(f'Unknown option: {opt}')
+            print(__doc__)
+            sys.exit(1)
+        i += 2
+    return args
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    workdir = tempfile.mkdtemp(prefix='vpnbypass_latency.')
+
+    try:
+        fifo, record, tcpdump, pfctl = write_fakes(workdir)
+
+        # Point the real sniffer at the fakes and at temporary state
+        config = os.path.join(workdir, 'vpn_bypass_domains.conf')
+        with open(config, 'w') as f:
+            f.write(f'*.{BASE_DOMAIN}\n')
+        vpnbypass_sniffer.CONFIG_FILE = config
+        vpnbypass_sniffer.DISCOVERED_DOMAINS_FILE = os.path.join(workdir, 'discovered.txt')
+        vpnbypass_sniffer.LASTSEEN_FILE = os.path.join(workdir, 'lastseen.txt')
+        vpnbypass_sniffer.STATS_FILE = os.path.join(workdir, 'stats.json')
+        vpnbypass_sniffer.LOG_FILE = os.path.join(workdir, 'sniffer.log')
+        vpnbypass_sniffer.TCPDUMP = tcpdump
+        vpnbypass_sniffer.PFCTL = pfctl
+        record_delta = vpnbypass_sync.record_delta
+        vpnbypass_sync.record_delta = lambda entries, state_dir=None: record_delta(entries, workdir)
+
+        recorder = Recorder(record)
+        recorder.start()
+
+        # The sniffer logs every addition to stdout, keep the report readable
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        sniffer = threading.Thread(target=vpnbypass_sniffer.run_sniffer, daemon=True)
+        sniffer.start()
+
+        # Opening the FIFO blocks until the fake tcpdump has it open for reading
+        fifo_fd = os.open(fifo, os.O_WRONLY)
+        flags = fcntl.fcntl(fifo_fd, fcntl.F_GETFL)
+        fcntl.fcntl(fifo_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+        counter = [1]
+        names = []
+        rows = []
+        for rate in args['rates']:
+            emitted, dropped = emit(fifo_fd, rate, args['duration'],
+                                    args['new_ratio'], counter, names)
+            deadline = time.perf_counter() + args['drain']
+            while time.perf_counter() < deadline and \
+                    not all(ip in recorder.seen for ip in emitted):
+                time.sleep(0.05)
+
+            latencies = sorted((recorder.seen[ip] - t) * 1000
+                               for ip, t in emitted.items() if ip in recorder.seen)
+            total = len(emitted) + dropped
+            lost = total - len(latencies)
+            rows.append((rate, total, lost * 100.0 / total if total else 0.0,
+                         percentile(latencies, 50), percentile(latencies, 90),
+                         percentile(latencies, 99), latencies[-1] if latencies else 0.0))
+
+        vpnbypass_sniffer.running = False
+        recorder.stop = True
+        os.close(fifo_fd)
+        sniffer.join(timeout=5)
+
+        sys.stdout = stdout
+        print(f"{'rate/s':>8} {'answers':>8} {'drop%':>7} {'p50 ms':>9} "
+              f"{'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for rate, total, drop, p50, p90, p99, worst in rows:
+            print(f'{rate:>8} {total:>8} {drop:>7.1f} {p50:>9.1f} '
+                  f'{p90:>9.1f} {p99:>9.1f} {worst:>9.1f}')
+    finally:
+        sys.stdout = sys.__stdout__
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
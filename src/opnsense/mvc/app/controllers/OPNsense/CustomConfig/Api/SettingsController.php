@@ -50,6 +50,15 @@ class SettingsController extends ApiMutableModelControllerBase
             if (isset($post['updateinterval'])) {
                 $mdl->vpnbypass->updateinterval = (string)$post['updateinterval'];
             }
+            if (isset($post['discoveredmaxage'])) {
+                $mdl->vpnbypass->discoveredmaxage = (string)$post['discoveredmaxage'];
+            }
+            if (isset($post['discoveredmaxentries'])) {
+                $mdl->vpnbypass->discoveredmaxentries = (string)$post['discoveredmaxentries'];
+            }
+            if (isset($post['hasyncpush'])) {
+                $mdl->vpnbypass->hasyncpush = (string)$post['hasyncpush'];
+            }
 
             $valMsgs = $mdl->performValidation();
             foreach ($valMsgs as $field => $msg) {
@@ -0,0 +1,178 @@
+#!/usr/local/bin/python3
+"""
+Shared config.xml reader for the Custom Config scripts
+
+Streams /conf/config.xml with iterparse and keeps only the subtrees the
+plugin needs (OPNsense/CustomConfig, interfaces and hasync). The extracted values
+are cached in a small JSON sidecar keyed by config.xml's mtime and size,
+so repeated invocations skip the XML parse entirely.
+
+Usage from other scripts:
+    import configxml
+    configxml.get_lan_interface()
+    configxml.get_custom_files()
+    configxml.get_vpnbypass_settings()
+    configxml.get_hasync_peer()
+
+Usage:
+    configxml.py dump    - Print the extracted values as JSON
+"""
+
+import json
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+# File paths
+CONFIG_XML = "/conf/config.xml"
+CACHE_FILE = "/var/run/customconfig_configxml.json"
+
+# Bump when the extracted layout changes so old caches are ignored
+CACHE_VERSION = 3
+
+CUSTOMCONFIG_PATH = ('opnsense', 'OPNsense', 'CustomConfig')
+INTERFACES_PATH = ('opnsense', 'interfaces')
+HASYNC_PATH = ('opnsense', 'hasync')
+
+FILE_FIELDS = ('enabled', 'name', 'filepath', 'content', 'permissions', 'reloadcmd')
+
+
+def file_entry(elem):
+    """Convert one custom file element into a dict of its field texts"""
+    entry = {}
+    for field in FILE_FIELDS:
+        child = elem.find(field)
+        entry[field] = child.text if child is not None and child.text is not None else ''
+    return entry
+
+
+def extract_customconfig(elem):
+    """Pull the values the scripts need out of the CustomConfig subtree"""
+    files = []
+    customfiles = elem.find('customfiles')
+    if customfiles is not None:
+        for item in customfiles.findall('files'):
+            if item.find('filepath') is not None:
+                # ArrayField layout: one <files uuid="..."> per entry
+                files.append(file_entry(item))
+            else:
+                # Nested layout: <files><entry uuid="...">...</entry></files>
+                for child in item:
+                    if child.find('filepath') is not None:
+                        files.append(file_entry(child))
+
+    vpnbypass = {}
+    settings = elem.find('vpnbypass')
+    if settings is not None:
+        vpnbypass = {child.tag: child.text or '' for child in settings if len(child) == 0}
+    return {'customfiles': files, 'vpnbypass': vpnbypass}
+
+
+def extract_interfaces(elem):
+    """Map interface names (lan, wan, optN) to their settings"""
+    interfaces = {}
+    for iface in elem:
+        interfaces[iface.tag] = {
+            child.tag: child.text or '' for child in iface if len(child) == 0
+        }
+    return interfaces
+
+
+def parse_config(path=CONFIG_XML):
+    """
+    Stream config.xml and extract only the wanted subtrees.
+
+    Elements outside those subtrees are cleared as soon as they end so
+    memory stays flat regardless of the size of the rest of the config,
+    and parsing stops once both subtrees have been seen.
+    """
+    result = {'customconfig': {'customfiles': [], 'vpnbypass': {}}, 'interfaces': {}, 'hasync': {}}
+    wanted = {CUSTOMCONFIG_PATH, INTERFACES_PATH, HASYNC_PATH}
+    stack = []
+
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem.tag)
+            continue
+
+        path_key = tuple(stack)
+        stack.pop()
+
+        if path_key == CUSTOMCONFIG_PATH:
+            result['customconfig'] = extract_customconfig(elem)
+            wanted.discard(path_key)
+        elif path_key == INTERFACES_PATH:
+            result['interfaces'] = extract_interfaces(elem)
+            wanted.discard(path_key)
+        elif path_key == HASYNC_PATH:
+            result['hasync'] = {child.tag: child.text or '' for child in elem if len(child) == 0}
+            wanted.discard(path_key)
+        elif any(path_key[:len(w)] == w for w in wanted):
+            # Inside a wanted subtree, keep it until the subtree ends
+            continue
+
+        elem.clear()
+        if not wanted:
+            break
+
+    return result
+
+
+def load(path=CONFIG_XML, cache_file=CACHE_FILE):
+    """Return the extracted values, from the sidecar cache when still valid"""
+    st = os.stat(path)
+    key = [CACHE_VERSION, os.path.abspath(path), st.st_mtime_ns, st.st_size]
+
+    try:
+        with open(cache_file, 'r') as f:
+            cached = json.load(f)
+        if cached.get('key') == key:
+            return cached['data']
+    except:
+        pass
+
+    data = parse_config(path)
+
+    # Custom file contents may be sensitive, keep the cache root-only
+    try:
+        tmp = cache_file + '.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'key': key, 'data': data}, f, separators=(',', ':'))
+        os.replace(tmp, cache_file)
+    except:
+        pass
+
+    return data
+
+
+def get_lan_interface(path=CONFIG_XML):
+    """Return the LAN device name (e.g. igb1), or None if not configured"""
+    lan = load(path)['interfaces'].get('lan', {})
+    return lan.get('if') or None
+
+
+def get_custom_files(path=CONFIG_XML):
+    """Return the configured custom file entries as dicts"""
+    return load(path)['customconfig']['customfiles']
+
+
+def get_vpnbypass_settings(path=CONFIG_XML):
+    """Return the VPN bypass settings (enabled, domains, ...) as strings"""
+    return load(path)['customconfig']['vpnbypass']
+
+
+def get_hasync_peer(path=CONFIG_XML):
+    """Return the HA sync peer address (hasync/synchronizetoip), or None"""
+    return load(path)['hasync'].get('synchronizetoip') or None
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != 'dump':
+        print("Usage: configxml.py dump")
+        sys.exit(1)
+    print(json.dumps(load(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,77 +8,198 @@ CONFIG_XML="/conf/config.xml"
 
 # Use Python to parse config.xml and write files
 /usr/local/bin/python3 << 'PYTHON_SCRIPT'
-import xml.etree.ElementTree as ET
+import hashlib
 import os
+import signal
 import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, '/usr/local/opnsense/scripts/OPNsense/CustomConfig')
+import configxml
 
 config_file = '/conf/config.xml'
+reload_workers = 4
+reload_timeout = 30
+
+
+def file_digest(path):
+    """Return the sha256 of a file's content, or None if it cannot be read."""
+    try:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                h.update(chunk)
+        return h.hexdigest()
+    except OSError:
+        return None
+
+
+def atomic_write(path, data, mode):
+    """
+    Write data via temp file + fsync + rename so readers never see a partial file.
+
+    Symlinks are followed so the link's target is replaced, not the link,
+    and an existing file keeps its owner and group.
+    """
+    path = os.path.realpath(path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        st = None
+
+    parent_dir = os.path.dirname(path) or '.'
+    fd, tmp = tempfile.mkstemp(dir=parent_dir, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if st is not None:
+            os.chown(tmp, st.st_uid, st.st_gid)
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+    dir_fd = os.open(parent_dir, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def run_reload(cmd):
+    """
+    Run one reload command, returning (cmd, status, output).
+
+    Output goes to a temp file rather than a pipe, so a daemon the command
+    leaves running with our stdout open does not hold us until the
+    timeout; only the shell itself is waited for. On timeout the whole
+    process group is killed.
+    """
+    try:
+        with tempfile.TemporaryFile() as out:
+            proc = subprocess.Popen(cmd, shell=True, stdout=out, stderr=subprocess.STDOUT,
+                                    start_new_session=True)
+            try:
+                returncode = proc.wait(timeout=reload_timeout)
+            except subprocess.TimeoutExpired:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                proc.wait()
+                status = f'timed out after {reload_timeout}s'
+            else:
+                status = 'ok' if returncode == 0 else f'exit {returncode}'
+            out.seek(0)
+            output = out.read().decode(errors='replace').strip()
+        return cmd, status, output
+    except Exception as e:
+        return cmd, f'failed: {e}', ''
+
+
+def run_reloads(commands):
+    """
+    Run the collected reload commands once each, concurrently.
+
+    commands maps each distinct command to the file names that need it.
+    Returns the number of commands that did not succeed.
+    """
+    if not commands:
+        return 0
+
+    failed = 0
+    print(f"\nRunning {len(commands)} reload command(s):")
+    with ThreadPoolExecutor(max_workers=reload_workers) as pool:
+        for cmd, status, output in pool.map(run_reload, commands):
+            print(f"  [{status}] {cmd} (for {', '.join(commands[cmd])})")
+            for line in output.splitlines()[-5:]:
+                print(f"      {line}")
+            if status != 'ok':
+                failed += 1
+    return failed
+
+
+files_written = 0
+files_skipped = 0
+files_failed = 0
+reload_commands = {}
 
 try:
-    tree = ET.parse(config_file)
-    root = tree.getroot()
-
-    # Find customfiles section
-    customconfig = root.find('.//OPNsense/CustomConfig/customfiles/files')
-    if customconfig is None:
+    # Only the CustomConfig subtree is extracted (cached by config.xml mtime/size)
+    custom_files = configxml.get_custom_files(config_file)
+    if not custom_files:
         print("No custom files configured")
         exit(0)
 
-    files_written = 0
-
-    for file_elem in customconfig:
-        # Skip non-file elements
-        if file_elem.tag == 'file':
+    for entry in custom_files:
+        if entry['enabled'] != '1':
             continue
 
-        enabled = file_elem.find('enabled')
-        if enabled is None or enabled.text != '1':
+        if not entry['filepath']:
             continue
 
-        name = file_elem.find('name')
-        filepath = file_elem.find('filepath')
-        content = file_elem.find('content')
-        permissions = file_elem.find('permissions')
-        reloadcmd = file_elem.find('reloadcmd')
+        filepath_text = entry['filepath'].strip()
+        data = entry['content'].encode()
+        name_text = entry['name'] or filepath_text
 
-        if filepath is None or filepath.text is None:
-            continue
-
-        filepath_text = filepath.text.strip()
-        content_text = content.text if content is not None and content.text else ''
+        mode = None
+        if entry['permissions']:
+            try:
+                mode = int(entry['permissions'], 8)
+            except ValueError:
+                pass
 
-        # Ensure parent directory exists
-        parent_dir = os.path.dirname(filepath_text)
-        if parent_dir and not os.path.exists(parent_dir):
-            os.makedirs(parent_dir, exist_ok=True)
+        # Compare content hash and mode with what is on disk
+        try:
+            current_mode = os.stat(filepath_text).st_mode & 0o7777
+        except OSError:
+            current_mode = None
+        if mode is None:
+            mode = current_mode if current_mode is not None else 0o644
+
+        if current_mode is not None and current_mode == mode and \
+                file_digest(filepath_text) == hashlib.sha256(data).hexdigest():
+            print(f"Unchanged: {name_text} -> {filepath_text}")
+            files_skipped += 1
+            continue
 
-        # Write file
-        with open(filepath_text, 'w') as f:
-            f.write(content_text)
+        # A failing file must not cost the files already written their reload
+        try:
+            parent_dir = os.path.dirname(filepath_text)
+            if parent_dir and not os.path.exists(parent_dir):
+                os.makedirs(parent_dir, exist_ok=True)
 
-        # Set permissions
-        if permissions is not None and permissions.text:
-            try:
-                os.chmod(filepath_text, int(permissions.text, 8))
-            except:
-                pass
+            atomic_write(filepath_text, data, mode)
+        except Exception as e:
+            print(f"Error writing {name_text} -> {filepath_text}: {e}")
+            files_failed += 1
+            continue
 
-        name_text = name.text if name is not None and name.text else filepath_text
         print(f"Written: {name_text} -> {filepath_text}")
         files_written += 1
 
-        # Run reload command if specified
-        if reloadcmd is not None and reloadcmd.text:
-            try:
-                subprocess.run(reloadcmd.text, shell=True, timeout=30)
-                print(f"  Reload command executed: {reloadcmd.text}")
-            except Exception as e:
-                print(f"  Reload command failed: {e}")
-
-    print(f"\nTotal files written: {files_written}")
+        # Collect reload commands, identical ones run only once
+        if entry['reloadcmd'].strip():
+            reload_commands.setdefault(entry['reloadcmd'].strip(), []).append(name_text)
 
 except Exception as e:
     print(f"Error: {e}")
+    files_failed += 1
+
+finally:
+    # Every file that was actually replaced gets its reload
+    reloads_failed = run_reloads(reload_commands)
+
+    print(f"\nTotal files written: {files_written}, unchanged: {files_skipped}, failed: {files_failed}")
+    if reload_commands:
+        print(f"Reload commands run: {len(reload_commands)}, failed: {reloads_failed}")
+
+if files_failed:
     exit(1)
 PYTHON_SCRIPT
 
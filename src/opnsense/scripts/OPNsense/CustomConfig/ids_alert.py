@@ -4,13 +4,37 @@ IDS Email Alert Script
 Monitors Suricata eve.json for new alerts and sends email notifications.
 
 Configuration is read from /usr/local/etc/ids_alert.conf
+
+Usage:
+    ids_alert.py           - Process new alerts once (cron mode)
+    ids_alert.py --follow  - Stay resident and tail eve.json continuously
+    ids_alert.py --query [--since 7d] [--sid N] [--src IP] [--dest IP]
+                 [--top signature|sid|src_ip|dest_ip|dest_port] [--limit N]
+                           - Query the local alert history (JSON output)
+
+Follow mode replaces the cron job; do not run both against the same state.
+Send SIGHUP to a follow-mode process to reload the configuration.
 """
 
+import bz2
+import glob
+import gzip
+import hashlib
+import heapq
 import json
+import lzma
+import multiprocessing
 import os
+import random
+import select
+import signal
 import smtplib
+import sqlite3
 import re
+import sys
+import time
 from email.mime.text import MIMEText
+from email import message_from_string
 from configparser import ConfigParser
 from datetime import datetime
 
@@ -19,6 +43,47 @@ CONFIG_FILE = '/usr/local/etc/ids_alert.conf'
 EVE_LOG = '/var/log/suricata/eve.json'
 STATE_FILE = '/var/run/ids_alert_pos'
 DIGEST_FILE = '/var/run/ids_alert_digest.json'
+SPOOL_DIR = '/var/spool/ids_alert'
+SPOOL_BACKOFF_FILE = os.path.join(SPOOL_DIR, 'backoff.json')
+CORRELATION_FILE = '/var/run/ids_alert_correlation.json'
+HISTORY_DB = '/var/db/ids_alert_history.db'
+
+# Digest aggregation limits
+DIGEST_EXAMPLES = 3       # Reservoir size per signature
+DIGEST_MAX_KEYS = 1000    # Distinct sources/ports tracked before lumping into 'other'
+
+# Correlation defaults (overridable in the [correlation] section)
+DEFAULT_WINDOW = 3600           # Seconds a (signature, source, port) stays one incident
+DEFAULT_BUCKET = 300            # Bucket width inside the window
+DEFAULT_ESCALATE = '10,100,1000'  # Window counts that re-notify an ongoing incident
+CORRELATION_MAX_KEYS = 10000
+
+# History defaults (overridable in the [history] section)
+DEFAULT_RETENTION_DAYS = 30
+HISTORY_COLUMNS = ('signature', 'sid', 'src_ip', 'dest_ip', 'dest_port')
+
+# Backlog catch-up: remainders larger than two chunks are parsed in parallel
+CATCHUP_CHUNK = 16 * 1024 * 1024
+ROTATED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+# Follow mode defaults (overridable in the [daemon] section)
+DEFAULT_DEBOUNCE = 30
+POLL_INTERVAL = 1.0
+
+# Outbound spool retry backoff (seconds), doubled after each failed flush
+SPOOL_BACKOFF_MIN = 30
+SPOOL_BACKOFF_MAX = 900
+
+# Global state (follow mode)
+running = True
+reload_requested = False
+
+# Global state (history)
+history_batch = []
+history_pruned_at = 0
+
+# Global state (outbound mail)
+smtp_server = None
 
 def load_config():
     """Load configuration from file."""
@@ -30,32 +95,87 @@ def load_config():
     config.read(CONFIG_FILE)
     return config
 
-def get_last_position():
-    """Get last read position from state file."""
+def load_state():
+    """Load the raw state dict from the state file."""
     try:
         with open(STATE_FILE, 'r') as f:
-            data = json.load(f)
-            return data.get('position', 0), data.get('inode', 0)
+            return json.load(f)
     except:
-        return 0, 0
+        return {}
+
+def save_position(position, inode, pending=None, head=None):
+    """
+    Save current position (and any unsent immediate alerts) to state file.
+
+    head is the fingerprint of the file's first line, used to recognise
+    the file again after it has been rotated and possibly compressed.
+    """
+    data = {'position': position, 'inode': inode}
+    if head:
+        data['head'] = head
+    if pending:
+        data['pending'] = pending
+    tmp = STATE_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, STATE_FILE)
+
+def new_digest(date=None):
+    """Return an empty aggregated digest."""
+    return {'date': date, 'total': 0, 'signatures': {}, 'sources': {}, 'ports': {}}
+
+def add_to_digest(digest, alert):
+    """
+    Fold one alert into the digest aggregates.
+
+    Only counts per signature, source and destination port are kept, plus
+    a small reservoir-sampled set of examples per signature, so the digest
+    size is bounded by cardinality rather than by alert volume.
+    """
+    sig = alert.get('alert', {}).get('signature', 'Unknown')
+    src_ip = alert.get('src_ip', '?')
+    dest_port = str(alert.get('dest_port', '?'))
 
-def save_position(position, inode):
-    """Save current position to state file."""
-    with open(STATE_FILE, 'w') as f:
-        json.dump({'position': position, 'inode': inode}, f)
+    digest['total'] += 1
+
+    entry = digest['signatures'].setdefault(sig, {'count': 0, 'examples': []})
+    entry['count'] += 1
+    example = [src_ip, dest_port, alert.get('timestamp', '')]
+    if len(entry['examples']) < DIGEST_EXAMPLES:
+        entry['examples'].append(example)
+    else:
+        slot = random.randrange(entry['count'])
+        if slot < DIGEST_EXAMPLES:
+            entry['examples'][slot] = example
+
+    for key, value in (('sources', src_ip), ('ports', dest_port)):
+        counts = digest[key]
+        if value not in counts and len(counts) >= DIGEST_MAX_KEYS:
+            value = 'other'
+        counts[value] = counts.get(value, 0) + 1
 
 def load_digest():
-    """Load digest alerts from file."""
+    """Load digest aggregates from file."""
     try:
         with open(DIGEST_FILE, 'r') as f:
-            return json.load(f)
+            data = json.load(f)
     except:
-        return {'date': None, 'alerts': []}
+        return new_digest()
+
+    if 'alerts' in data:
+        # Older format stored the raw events, fold them into aggregates
+        digest = new_digest(data.get('date'))
+        for alert in data['alerts']:
+            add_to_digest(digest, alert)
+        return digest
+    return data
 
 def save_digest(digest):
-    """Save digest alerts to file."""
-    with open(DIGEST_FILE, 'w') as f:
-        json.dump(digest, f)
+    """Save digest aggregates to file."""
+    tmp = DIGEST_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(digest, f, separators=(',', ':'))
+    os.replace(tmp, DIGEST_FILE)
 
 def should_digest(config, alert):
     """Check if alert should go to daily digest instead of immediate email."""
@@ -97,35 +217,155 @@ def should_ignore(config, alert):
     
     return False
 
-def send_email(config, subject, body):
-    """Send email via SMTP."""
+def spool_message(config, subject, body):
+    """
+    Write a message to the outbound spool and return its path.
+
+    The file is written under a temporary name and renamed into place so
+    a crash never leaves a half-written message behind for the sender.
+    """
     msg = MIMEText(body)
     msg['Subject'] = subject
     msg['From'] = config.get('smtp', 'from')
     msg['To'] = config.get('smtp', 'to')
 
+    os.makedirs(SPOOL_DIR, mode=0o700, exist_ok=True)
+    name = f"{time.time():.6f}-{os.getpid()}.eml"
+    path = os.path.join(SPOOL_DIR, name)
+    with open(path + '.tmp', 'w') as f:
+        f.write(msg.as_string())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+    return path
+
+def spooled_messages():
+    """List spooled messages, oldest first."""
     try:
+        names = os.listdir(SPOOL_DIR)
+    except OSError:
+        return []
+    return [os.path.join(SPOOL_DIR, n) for n in sorted(names) if n.endswith('.eml')]
+
+def smtp_connect(config):
+    """Return the shared authenticated SMTP session, opening it if needed."""
+    global smtp_server
+    if smtp_server is None:
         server = smtplib.SMTP(
             config.get('smtp', 'server'),
             config.getint('smtp', 'port'),
             timeout=30
         )
-        server.starttls()
-        server.login(
-            config.get('smtp', 'user'),
-            config.get('smtp', 'password')
-        )
-        server.sendmail(
-            config.get('smtp', 'from'),
-            [config.get('smtp', 'to')],
-            msg.as_string()
-        )
-        server.quit()
+        if config.getboolean('smtp', 'starttls', fallback=True):
+            server.starttls()
+        if config.get('smtp', 'user', fallback=''):
+            server.login(
+                config.get('smtp', 'user'),
+                config.get('smtp', 'password')
+            )
+        smtp_server = server
+    return smtp_server
+
+def smtp_close():
+    """Close the shared SMTP session."""
+    global smtp_server
+    if smtp_server is not None:
+        try:
+            smtp_server.quit()
+        except:
+            pass
+        smtp_server = None
+
+def smtp_deliver(config, path):
+    """Send one spooled message over the shared session."""
+    with open(path, 'r') as f:
+        raw = f.read()
+    msg = message_from_string(raw)
+    try:
+        smtp_connect(config).sendmail(msg['From'], [msg['To']], raw)
+    except (smtplib.SMTPServerDisconnected, ConnectionError):
+        # Reused session timed out on the server side, reconnect once
+        smtp_close()
+        smtp_connect(config).sendmail(msg['From'], [msg['To']], raw)
+
+def load_spool_backoff():
+    """Return (retry_at, backoff) of the last failed flush, kept across cron runs."""
+    try:
+        with open(SPOOL_BACKOFF_FILE, 'r') as f:
+            state = json.load(f)
+        return state.get('retry_at', 0), state.get('backoff', 0)
+    except:
+        return 0, 0
+
+def save_spool_backoff(retry_at, backoff):
+    """Store the retry time and backoff; both zero removes the file."""
+    if not backoff:
+        try:
+            os.remove(SPOOL_BACKOFF_FILE)
+        except OSError:
+            pass
+        return
+    tmp = SPOOL_BACKOFF_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'retry_at': retry_at, 'backoff': backoff}, f)
+    os.replace(tmp, SPOOL_BACKOFF_FILE)
+
+def flush_spool(config):
+    """
+    Send everything in the spool, oldest first.
+
+    Delivered messages are removed; on a transient error the remaining
+    messages stay spooled and further attempts are held off with an
+    exponential backoff. The backoff is stored in SPOOL_DIR so it also
+    holds between cron runs. Messages the server permanently rejects
+    (5xx) are renamed to .failed so they do not block the queue.
+    Returns True when the spool is empty.
+    """
+    messages = spooled_messages()
+    if not messages:
         return True
-    except Exception as e:
-        print(f'Email error: {e}')
+    retry_at, backoff = load_spool_backoff()
+    if time.time() < retry_at:
+        return False
+
+    for path in messages:
+        try:
+            smtp_deliver(config, path)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                smtplib.SMTPDataError) as e:
+            code = getattr(e, 'smtp_code', 0)
+            if isinstance(e, smtplib.SMTPRecipientsRefused):
+                code = min(c for c, _ in e.recipients.values())
+            if code >= 500:
+                print(f'Email rejected, moving aside: {e}')
+                os.replace(path, path[:-4] + '.failed')
+                continue
+            print(f'Email error: {e}')
+        except Exception as e:
+            print(f'Email error: {e}')
+        else:
+            os.remove(path)
+            continue
+
+        smtp_close()
+        backoff = min(max(backoff * 2, SPOOL_BACKOFF_MIN), SPOOL_BACKOFF_MAX)
+        save_spool_backoff(time.time() + backoff, backoff)
         return False
 
+    if backoff:
+        save_spool_backoff(0, 0)
+    return True
+
+def send_email(config, subject, body):
+    """
+    Queue an email and try to deliver the spool.
+
+    Returns True if the spool was fully delivered, False if the message
+    is waiting in SPOOL_DIR for a later retry.
+    """
+    spool_message(config, subject, body)
+    return flush_spool(config)
+
 def format_alert(alert):
     """Format a single alert for email."""
     ts = alert.get('timestamp', 'Unknown time')
@@ -141,43 +381,519 @@ def format_alert(alert):
     src = f"{src_ip}:{src_port}" if src_port else src_ip
     dest = f"{dest_ip}:{dest_port}" if dest_port else dest_ip
 
-    return f"""
+    text = f"""
 [Severity {severity}] {sig}
   Category: {category}
   Time: {ts}
   {src} -> {dest} ({proto})
 """
+    corr = alert.get('correlation')
+    if corr and corr['escalated']:
+        text += f"  ESCALATED: {corr['count']} hits in the last {corr['window'] // 60} minutes\n"
+    return text
+
+def new_correlation():
+    """Return empty correlation state."""
+    return {}
+
+def load_correlation():
+    """
+    Load the sliding-window state from file.
+
+    Each key 'signature|src_ip|dest_port' maps to
+    [last_notified, escalation_level, [[bucket, count], ...]].
+    """
+    try:
+        with open(CORRELATION_FILE, 'r') as f:
+            return json.load(f)
+    except:
+        return new_correlation()
+
+def save_correlation(corr):
+    """Save the sliding-window state to file."""
+    tmp = CORRELATION_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(corr, f, separators=(',', ':'))
+    os.replace(tmp, CORRELATION_FILE)
+
+def correlation_settings(config):
+    """Read window, bucket width and escalation thresholds from config."""
+    window = config.getint('correlation', 'window', fallback=DEFAULT_WINDOW)
+    bucket = max(1, config.getint('correlation', 'bucket', fallback=DEFAULT_BUCKET))
+    escalate = config.get('correlation', 'escalate', fallback=DEFAULT_ESCALATE)
+    thresholds = sorted(int(t) for t in escalate.split(',') if t.strip())
+    return window, bucket, thresholds
+
+def event_time(alert):
+    """Return the eve timestamp of an alert as epoch seconds (now if absent)."""
+    try:
+        return datetime.strptime(alert['timestamp'], '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()
+    except:
+        return time.time()
+
+def prune_correlation(corr, now, window, bucket):
+    """Drop expired buckets and idle keys, keeping at most CORRELATION_MAX_KEYS."""
+    oldest = int((now - window) // bucket)
+    for key in list(corr):
+        notified, level, buckets = corr[key]
+        buckets[:] = [b for b in buckets if b[0] > oldest]
+        if not buckets and now - notified >= window:
+            del corr[key]
 
-def send_digest(config, digest_alerts):
+    if len(corr) > CORRELATION_MAX_KEYS:
+        oldest_first = sorted(corr, key=lambda k: corr[k][2][-1][0] if corr[k][2] else 0)
+        for key in oldest_first[:len(corr) - CORRELATION_MAX_KEYS]:
+            del corr[key]
+
+def correlate(config, corr, alerts):
+    """
+    Filter a batch of immediate alerts through the sliding-window engine.
+
+    Alerts are counted per (signature, src_ip, dest_port) in time buckets.
+    The first alert of an incident is sent; repeats inside the window are
+    suppressed unless the window count crosses the next escalation
+    threshold. Returns the alerts to email, annotated with their window
+    count under 'correlation'.
+    """
+    if not config.getboolean('correlation', 'enabled', fallback=True):
+        return alerts
+
+    window, bucket, thresholds = correlation_settings(config)
+    to_send = []
+
+    for alert in alerts:
+        ts = event_time(alert)
+        b = int(ts // bucket)
+        key = '|'.join((
+            alert.get('alert', {}).get('signature', 'Unknown'),
+            str(alert.get('src_ip', '?')),
+            str(alert.get('dest_port', '?'))
+        ))
+
+        entry = corr.setdefault(key, [0, 0, []])
+        buckets = entry[2]
+        oldest = int((ts - window) // bucket)
+        buckets[:] = [x for x in buckets if x[0] > oldest]
+        if buckets and buckets[-1][0] == b:
+            buckets[-1][1] += 1
+        else:
+            buckets.append([b, 1])
+            buckets.sort()
+        count = sum(c for _, c in buckets)
+
+        escalated = False
+        if ts - entry[0] >= window:
+            # New incident; thresholds the window count already meets are
+            # covered by this notification and must not re-escalate at once
+            entry[0] = ts
+            entry[1] = sum(1 for t in thresholds if t <= count)
+        elif entry[1] < len(thresholds) and count >= thresholds[entry[1]]:
+            while entry[1] < len(thresholds) and count >= thresholds[entry[1]]:
+                entry[1] += 1
+            escalated = True
+        else:
+            continue
+
+        alert['correlation'] = {'count': count, 'window': window, 'escalated': escalated}
+        to_send.append(alert)
+
+    prune_correlation(corr, time.time(), window, bucket)
+    return to_send
+
+def send_digest(config, digest):
     """Send daily digest email."""
-    if not digest_alerts:
+    total = digest['total']
+    if not total:
         return
     
-    # Group by signature
-    sig_counts = {}
-    for a in digest_alerts:
-        sig = a.get('alert', {}).get('signature', 'Unknown')
-        if sig not in sig_counts:
-            sig_counts[sig] = {'count': 0, 'examples': []}
-        sig_counts[sig]['count'] += 1
-        if len(sig_counts[sig]['examples']) < 3:
-            sig_counts[sig]['examples'].append(a)
-    
-    body = f"Daily IDS Digest - {len(digest_alerts)} alert(s):\n"
+    # Seven day totals from the history store give each signature context
+    weekly = {}
+    if os.path.exists(HISTORY_DB):
+        try:
+            conn = history_open()
+            result = query_history(conn, since=int(time.time()) - 7 * 86400,
+                                   top='signature', limit=len(digest['signatures']) + 100)
+            weekly = dict(result.get('top', []))
+            conn.close()
+        except Exception as e:
+            print(f'History error: {e}')
+
+    body = f"Daily IDS Digest - {total} alert(s):\n"
     body += "=" * 50 + "\n"
     
-    for sig, data in sorted(sig_counts.items(), key=lambda x: -x[1]['count']):
+    for sig, data in sorted(digest['signatures'].items(), key=lambda x: -x[1]['count']):
         count = data['count']
-        body += f"\n{sig} ({count} times)\n"
+        if sig in weekly:
+            body += f"\n{sig} ({count} times, {weekly[sig]} in the last 7 days)\n"
+        else:
+            body += f"\n{sig} ({count} times)\n"
         body += "-" * 40 + "\n"
-        for example in data['examples']:
-            src_ip = example.get('src_ip', '?')
-            dest_port = example.get('dest_port', '?')
+        for src_ip, dest_port, ts in data['examples']:
             body += f"  {src_ip} -> port {dest_port}\n"
+
+    for title, key in (('Top sources', 'sources'), ('Top destination ports', 'ports')):
+        top = sorted(digest[key].items(), key=lambda x: -x[1])[:10]
+        body += f"\n{title}:\n"
+        body += "-" * 40 + "\n"
+        for value, count in top:
+            body += f"  {value}: {count}\n"
     
-    subject = f"[OPNsense IDS Digest] {len(digest_alerts)} alerts"
+    subject = f"[OPNsense IDS Digest] {total} alerts"
     send_email(config, subject, body)
 
+def classify_event(config, event, digest, immediate_alerts):
+    """Route a decoded eve event to the digest or the immediate list."""
+    if event.get('event_type') != 'alert':
+        return
+    if should_ignore(config, event):
+        history_record(event, 'ignored')
+    elif should_digest(config, event):
+        history_record(event, 'digest')
+        add_to_digest(digest, event)
+    else:
+        history_record(event, 'immediate')
+        immediate_alerts.append(event)
+
+def history_open():
+    """Open the alert history database, creating the schema if needed."""
+    conn = sqlite3.connect(HISTORY_DB, timeout=10)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS alerts (
+            ts INTEGER NOT NULL,
+            sid INTEGER,
+            signature TEXT,
+            severity INTEGER,
+            category TEXT,
+            src_ip TEXT,
+            src_port INTEGER,
+            dest_ip TEXT,
+            dest_port INTEGER,
+            proto TEXT,
+            disposition TEXT
+        );
+        CREATE INDEX IF NOT EXISTS alerts_ts ON alerts (ts);
+        CREATE INDEX IF NOT EXISTS alerts_sid ON alerts (sid, ts);
+        CREATE INDEX IF NOT EXISTS alerts_src ON alerts (src_ip, ts);
+        CREATE INDEX IF NOT EXISTS alerts_dest ON alerts (dest_ip, ts);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value
+        );
+    """)
+    return conn
+
+def history_record(alert, disposition):
+    """Queue an alert for the history store; written by history_flush()."""
+    info = alert.get('alert', {})
+    history_batch.append((
+        int(event_time(alert)),
+        info.get('signature_id'),
+        info.get('signature', 'Unknown'),
+        info.get('severity'),
+        info.get('category'),
+        alert.get('src_ip'),
+        alert.get('src_port'),
+        alert.get('dest_ip'),
+        alert.get('dest_port'),
+        alert.get('proto'),
+        disposition
+    ))
+
+def history_flush(config):
+    """
+    Write queued alerts to the history store in one transaction.
+
+    Rows older than the retention period are removed at most once an hour.
+    The time of the last prune is kept in the meta table, so cron runs
+    (one process each) share it.
+    """
+    global history_batch, history_pruned_at
+
+    if not config.getboolean('history', 'enabled', fallback=True):
+        history_batch = []
+        return
+    if not history_batch and time.time() - history_pruned_at < 3600:
+        return
+
+    try:
+        conn = history_open()
+        with conn:
+            conn.executemany('INSERT INTO alerts VALUES (?,?,?,?,?,?,?,?,?,?,?)', history_batch)
+            row = conn.execute("SELECT value FROM meta WHERE key = 'pruned_at'").fetchone()
+            history_pruned_at = row[0] if row else 0
+            if time.time() - history_pruned_at >= 3600:
+                days = config.getint('history', 'retention_days', fallback=DEFAULT_RETENTION_DAYS)
+                conn.execute('DELETE FROM alerts WHERE ts < ?', (int(time.time()) - days * 86400,))
+                history_pruned_at = int(time.time())
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('pruned_at', ?)", (history_pruned_at,))
+        conn.close()
+    except Exception as e:
+        print(f'History error: {e}')
+    history_batch = []
+
+def query_history(conn, since=None, sid=None, src_ip=None, dest_ip=None, top=None, limit=10):
+    """
+    Count alerts matching the filters and optionally list the top values.
+
+    Returns {'count': n} plus 'top': [[value, count], ...] when top names
+    one of HISTORY_COLUMNS.
+    """
+    where = []
+    params = []
+    for column, value in (('ts >= ?', since), ('sid = ?', sid),
+                          ('src_ip = ?', src_ip), ('dest_ip = ?', dest_ip)):
+        if value is not None:
+            where.append(column)
+            params.append(value)
+    clause = (' WHERE ' + ' AND '.join(where)) if where else ''
+
+    result = {'count': conn.execute('SELECT COUNT(*) FROM alerts' + clause, params).fetchone()[0]}
+    if top in HISTORY_COLUMNS:
+        rows = conn.execute(
+            f'SELECT {top}, COUNT(*) AS n FROM alerts{clause} GROUP BY {top} ORDER BY n DESC LIMIT ?',
+            params + [limit]
+        ).fetchall()
+        result['top'] = [list(r) for r in rows]
+    return result
+
+def parse_since(value):
+    """Turn '7d', '12h', '30m' or an epoch value into an epoch timestamp."""
+    units = {'d': 86400, 'h': 3600, 'm': 60}
+    if value[-1:] in units:
+        return int(time.time()) - int(value[:-1]) * units[value[-1]]
+    return int(value)
+
+def query_main(argv):
+    """
+    Handle --query: print history counts and top-N lists as JSON.
+
+    configd fills every parameter, so an empty value means the filter is unset.
+    """
+    options = {}
+    i = 0
+    while i + 1 < len(argv):
+        if argv[i + 1]:
+            options[argv[i].lstrip('-')] = argv[i + 1]
+        i += 2
+
+    if not os.path.exists(HISTORY_DB):
+        print(json.dumps({'count': 0}))
+        return
+
+    try:
+        conn = history_open()
+        result = query_history(
+            conn,
+            since=parse_since(options['since']) if 'since' in options else None,
+            sid=int(options['sid']) if 'sid' in options else None,
+            src_ip=options.get('src'),
+            dest_ip=options.get('dest'),
+            top=options.get('top'),
+            limit=int(options.get('limit', 10))
+        )
+        conn.close()
+    except Exception as e:
+        result = {'error': str(e)}
+    print(json.dumps(result))
+
+def open_log(path):
+    """Open a current or rotated (possibly compressed) eve log for reading."""
+    opener = ROTATED_OPENERS.get(os.path.splitext(path)[1], open)
+    return opener(path, 'rb')
+
+def log_fingerprint(f):
+    """Hash the first line of an open log; restores the file position."""
+    pos = f.tell()
+    f.seek(0)
+    line = f.readline(4096)
+    f.seek(pos)
+    if not line.endswith(b'\n'):
+        return None
+    return hashlib.sha1(line).hexdigest()
+
+def find_rotated_log(inode, head):
+    """
+    Locate the file eve.json was rotated to.
+
+    Uncompressed rotations keep their inode; compressed ones are matched
+    on the first-line fingerprint saved with the position.
+    """
+    candidates = []
+    for path in glob.glob(EVE_LOG + '.*'):
+        try:
+            candidates.append((os.path.getmtime(path), path))
+        except OSError:
+            # Removed or renamed by newsyslog since the glob
+            continue
+    for _, path in sorted(candidates, reverse=True):
+        ext = os.path.splitext(path)[1]
+        if ext in ROTATED_OPENERS:
+            if not head:
+                continue
+            try:
+                with open_log(path) as f:
+                    if log_fingerprint(f) == head:
+                        return path
+            except:
+                pass
+        elif ext.lstrip('.').isdigit():
+            try:
+                if os.stat(path).st_ino == inode:
+                    return path
+            except OSError:
+                pass
+    return None
+
+def parse_range(path, start, end):
+    """
+    Decode the alert events in [start, end) of a log (process pool worker).
+
+    Both offsets are line aligned. Cheap substring checks skip non-alert
+    events before they reach the JSON decoder.
+    """
+    alerts = []
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for line in f.read(end - start).splitlines():
+            if b'"alert"' not in line:
+                continue
+            try:
+                event = json.loads(line)
+            except:
+                continue
+            if event.get('event_type') == 'alert':
+                alerts.append(event)
+    return alerts
+
+def split_ranges(f, start, end, chunk):
+    """Split [start, end) into roughly chunk-sized ranges on line boundaries."""
+    bounds = [start]
+    pos = start + chunk
+    while pos < end:
+        f.seek(pos)
+        f.readline()
+        aligned = f.tell()
+        if aligned >= end:
+            break
+        bounds.append(aligned)
+        pos = aligned + chunk
+    bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def parallel_catch_up(config, f, digest, immediate_alerts):
+    """
+    Parse a large backlog of an uncompressed log in a process pool.
+
+    Everything up to the last full chunk boundary is split into line
+    aligned ranges; the per-range results are merged in timestamp order
+    before classification. The tail is left for read_events().
+    """
+    start = f.tell()
+    size = os.fstat(f.fileno()).st_size
+    f.seek(max(start, size - CATCHUP_CHUNK))
+    f.readline()
+    end = f.tell()
+    ranges = split_ranges(f, start, end, CATCHUP_CHUNK)
+    print(f'Catching up {end - start} bytes of {f.name} in {len(ranges)} ranges')
+
+    with multiprocessing.Pool(min(len(ranges), os.cpu_count() or 1)) as pool:
+        results = pool.starmap(parse_range, [(f.name, a, b) for a, b in ranges])
+
+    for event in heapq.merge(*results, key=lambda e: e.get('timestamp', '')):
+        classify_event(config, event, digest, immediate_alerts)
+    f.seek(end)
+
+def read_events(config, f, digest, immediate_alerts):
+    """
+    Read complete lines from the current position of a binary file handle.
+
+    The file is read in CATCHUP_CHUNK pieces, carrying a partial last line
+    over to the next piece, so a multi-GB compressed rotation is never held
+    in memory at once. A trailing partial line (eve.json still being
+    written) is left unread so the next call picks it up whole.
+    Returns the new position.
+    """
+    name = getattr(f, 'name', None)
+    if isinstance(name, str) and os.path.splitext(name)[1] not in ROTATED_OPENERS:
+        if os.fstat(f.fileno()).st_size - f.tell() > 2 * CATCHUP_CHUNK:
+            parallel_catch_up(config, f, digest, immediate_alerts)
+
+    carry = b''
+    while True:
+        chunk = f.read(CATCHUP_CHUNK)
+        if not chunk:
+            break
+        data = carry + chunk
+        end = data.rfind(b'\n') + 1
+        carry = data[end:]
+
+        for line in data[:end].splitlines():
+            if b'"alert"' not in line:
+                continue
+            try:
+                classify_event(config, json.loads(line), digest, immediate_alerts)
+            except:
+                pass
+
+    if carry:
+        f.seek(-len(carry), os.SEEK_CUR)
+    return f.tell()
+
+def is_rotated(state, inode, head):
+    """Check whether the saved position belongs to a different file."""
+    if inode != state.get('inode', 0):
+        return True
+    # Inode numbers are reused, so also compare the first-line fingerprint
+    return bool(head and state.get('head') and head != state['head'])
+
+def catch_up_rotated(config, state, digest, immediate_alerts):
+    """Finish the remainder of the file eve.json was rotated away from."""
+    if not state.get('position'):
+        return
+    path = find_rotated_log(state.get('inode', 0), state.get('head'))
+    if not path:
+        print('Rotated eve log not found, remainder skipped')
+        return
+    with open_log(path) as f:
+        f.seek(state['position'])
+        read_events(config, f, digest, immediate_alerts)
+    print(f'Finished rotated log {path}')
+
+def rollover_digest(config, digest):
+    """Send and reset the digest when the day has changed."""
+    today = datetime.now().strftime('%Y-%m-%d')
+    if digest['date'] != today:
+        # New day - send yesterday's digest if any, start fresh
+        if digest['total']:
+            send_digest(config, digest)
+        digest = new_digest(today)
+    return digest
+
+def send_immediate(config, immediate_alerts):
+    """Send one grouped email for a batch of immediate alerts."""
+    # Group by signature to reduce noise
+    sig_counts = {}
+    for a in immediate_alerts:
+        sig = a.get('alert', {}).get('signature', 'Unknown')
+        if sig not in sig_counts:
+            sig_counts[sig] = {'count': 0, 'example': a}
+        sig_counts[sig]['count'] += 1
+
+    body = f"OPNsense IDS detected {len(immediate_alerts)} alert(s):\n"
+    body += "=" * 50 + "\n"
+
+    for sig, data in sorted(sig_counts.items(), key=lambda x: -x[1]['count']):
+        count = data['count']
+        body += format_alert(data['example'])
+        if count > 1:
+            body += f"  (repeated {count} times)\n"
+
+    subject = f"[OPNsense IDS] {len(immediate_alerts)} alert(s) - {list(sig_counts.keys())[0][:50]}"
+
+    return send_email(config, subject, body)
+
 def main():
     config = load_config()
     if not config:
@@ -187,73 +903,217 @@ def main():
         print(f'Eve log not found: {EVE_LOG}')
         return
 
-    # Check if log rotated (inode changed)
-    current_inode = os.stat(EVE_LOG).st_ino
-    last_pos, last_inode = get_last_position()
-
-    if current_inode != last_inode:
-        last_pos = 0  # Log rotated, start from beginning
+    state = load_state()
+    last_pos = state.get('position', 0)
 
     # Load digest
-    today = datetime.now().strftime('%Y-%m-%d')
-    digest = load_digest()
-    if digest['date'] != today:
-        # New day - send yesterday's digest if any, start fresh
-        if digest['alerts']:
-            send_digest(config, digest['alerts'])
-        digest = {'date': today, 'alerts': []}
+    digest = rollover_digest(config, load_digest())
 
-    immediate_alerts = []
-    new_pos = last_pos
+    # Alerts left behind by a follow-mode daemon are sent with this batch
+    immediate_alerts = state.get('pending', [])
+
+    with open(EVE_LOG, 'rb') as f:
+        current_inode = os.fstat(f.fileno()).st_ino
+        head = log_fingerprint(f)
+
+        # Check if log rotated (inode or first line changed)
+        if is_rotated(state, current_inode, head):
+            catch_up_rotated(config, state, digest, immediate_alerts)
+            last_pos = 0
 
-    with open(EVE_LOG, 'r') as f:
         f.seek(last_pos)
-        for line in f:
-            try:
-                event = json.loads(line)
-                if event.get('event_type') == 'alert':
-                    if should_ignore(config, event):
-                        continue
-                    elif should_digest(config, event):
-                        digest['alerts'].append(event)
-                    else:
-                        immediate_alerts.append(event)
-            except:
-                pass
-        new_pos = f.tell()
+        new_pos = read_events(config, f, digest, immediate_alerts)
 
-    save_position(new_pos, current_inode)
-    save_digest(digest)
+    # Only distinct incidents (or escalations) are emailed
+    corr = load_correlation()
+    received = len(immediate_alerts)
+    immediate_alerts = correlate(config, corr, immediate_alerts)
+    if received > len(immediate_alerts):
+        print(f'Suppressed {received - len(immediate_alerts)} repeated alerts')
 
     if immediate_alerts:
-        # Group by signature to reduce noise
-        sig_counts = {}
-        for a in immediate_alerts:
-            sig = a.get('alert', {}).get('signature', 'Unknown')
-            if sig not in sig_counts:
-                sig_counts[sig] = {'count': 0, 'example': a}
-            sig_counts[sig]['count'] += 1
-
-        body = f"OPNsense IDS detected {len(immediate_alerts)} alert(s):\n"
-        body += "=" * 50 + "\n"
-
-        for sig, data in sorted(sig_counts.items(), key=lambda x: -x[1]['count']):
-            count = data['count']
-            body += format_alert(data['example'])
-            if count > 1:
-                body += f"  (repeated {count} times)\n"
-
-        subject = f"[OPNsense IDS] {len(immediate_alerts)} alert(s) - {list(sig_counts.keys())[0][:50]}"
-
-        if send_email(config, subject, body):
+        if send_immediate(config, immediate_alerts):
             print(f'Sent alert email for {len(immediate_alerts)} alerts')
         else:
-            print('Failed to send email')
+            print(f'Email for {len(immediate_alerts)} alerts spooled for retry')
     else:
+        # Retry anything left over from earlier runs
+        flush_spool(config)
         print('No new immediate alerts')
-    
-    if digest['alerts']:
-        print(f"{len(digest['alerts'])} alerts queued for daily digest")
+    smtp_close()
+
+    history_flush(config)
+    save_position(new_pos, current_inode, head=head)
+    save_digest(digest)
+    save_correlation(corr)
+
+    if digest['total']:
+        print(f"{digest['total']} alerts queued for daily digest")
+
+def signal_handler(signum, frame):
+    """Handle shutdown and reload signals in follow mode."""
+    global running, reload_requested
+    if signum == signal.SIGHUP:
+        reload_requested = True
+    else:
+        running = False
+
+def open_eve_log():
+    """Open eve.json and register it for change notifications if possible."""
+    f = open(EVE_LOG, 'rb')
+    kq = None
+    if hasattr(select, 'kqueue'):
+        kq = select.kqueue()
+        kq.control([select.kevent(
+            f.fileno(),
+            filter=select.KQ_FILTER_VNODE,
+            flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+            fflags=(select.KQ_NOTE_WRITE | select.KQ_NOTE_EXTEND |
+                    select.KQ_NOTE_DELETE | select.KQ_NOTE_RENAME)
+        )], 0, 0)
+    return f, kq
+
+def wait_for_change(kq, timeout):
+    """Block until eve.json changes or the timeout expires."""
+    if kq is not None:
+        try:
+            kq.control(None, 1, timeout)
+        except InterruptedError:
+            pass
+    else:
+        time.sleep(timeout)
+
+def follow():
+    """
+    Tail eve.json in-process (--follow).
+
+    Rules and digest stay in memory, immediate alerts are batched for the
+    debounce window before one email is sent, and the read position plus
+    any unsent alerts are checkpointed to STATE_FILE after every batch so
+    that a restart (or a fall back to cron mode) continues seamlessly.
+    """
+    global reload_requested
+
+    config = load_config()
+    if not config:
+        return
+
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGHUP, signal_handler)
+
+    debounce = config.getint('daemon', 'debounce', fallback=DEFAULT_DEBOUNCE)
+    digest = rollover_digest(config, load_digest())
+    corr = load_correlation()
+    state = load_state()
+    pending = state.get('pending', [])
+    pending_since = time.time() if pending else None
+    last_pos, last_inode = state.get('position', 0), state.get('inode', 0)
+
+    f = kq = head = None
+    inode = 0
+    pos = last_pos
+
+    print(f'Following {EVE_LOG} (debounce {debounce}s)')
+
+    while running:
+        if reload_requested:
+            reload_requested = False
+            config = load_config() or config
+            debounce = config.getint('daemon', 'debounce', fallback=DEFAULT_DEBOUNCE)
+            print('Configuration reloaded')
+
+        if f is None:
+            if not os.path.exists(EVE_LOG):
+                time.sleep(POLL_INTERVAL)
+                continue
+            f, kq = open_eve_log()
+            st = os.fstat(f.fileno())
+            inode = st.st_ino
+            head = log_fingerprint(f)
+            if state is not None and is_rotated(state, inode, head):
+                # Rotated while we were not running
+                catch_up_rotated(config, state, digest, pending)
+            elif inode == last_inode and last_pos <= st.st_size:
+                f.seek(last_pos)
+            state = None
+
+        before = (len(pending), digest['total'])
+        pos = read_events(config, f, digest, pending)
+
+        # Rotation: drain what is left of the old file, then reopen
+        try:
+            rotated = os.stat(EVE_LOG).st_ino != inode
+        except OSError:
+            rotated = True
+        if rotated:
+            pos = read_events(config, f, digest, pending)
+        elif os.fstat(f.fileno()).st_size < pos:
+            # Truncated in place
+            f.seek(0)
+            pos = 0
+
+        dirty = pos != last_pos or (len(pending), digest['total']) != before
+
+        if pending and pending_since is None:
+            pending_since = time.time()
+
+        if pending and time.time() - pending_since >= debounce:
+            received = len(pending)
+            pending = correlate(config, corr, pending)
+            if received > len(pending):
+                print(f'Suppressed {received - len(pending)} repeated alerts')
+            # Once spooled the email is durable, so pending can be cleared
+            if pending:
+                if send_immediate(config, pending):
+                    print(f'Sent alert email for {len(pending)} alerts')
+                else:
+                    print(f'Email for {len(pending)} alerts spooled for retry')
+            save_correlation(corr)
+            pending = []
+            pending_since = None
+            dirty = True
+        elif not pending:
+            flush_spool(config)
+
+        if digest['date'] != datetime.now().strftime('%Y-%m-%d'):
+            digest = rollover_digest(config, digest)
+            dirty = True
+
+        if dirty:
+            if head is None:
+                head = log_fingerprint(f)
+            history_flush(config)
+            save_position(pos, inode, pending, head)
+            save_digest(digest)
+            last_pos = pos
+
+        if rotated:
+            f.close()
+            if kq is not None:
+                kq.close()
+            f = kq = None
+            last_pos, last_inode = 0, 0
+            continue
+
+        timeout = POLL_INTERVAL
+        if pending_since is not None:
+            timeout = max(0.0, min(timeout, pending_since + debounce - time.time()))
+        wait_for_change(kq, timeout)
+
+    # Shutting down: checkpoint so unsent alerts survive the restart
+    history_flush(config)
+    if f is not None:
+        save_position(pos, inode, pending, head or log_fingerprint(f))
+        f.close()
+    save_digest(digest)
+    smtp_close()
+    print('Stopped')
 
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == '--follow':
+        follow()
+    elif len(sys.argv) > 1 and sys.argv[1] == '--query':
+        query_main(sys.argv[2:])
+    else:
+        main()
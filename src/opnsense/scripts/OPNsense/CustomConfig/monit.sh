@@ -6,11 +6,28 @@
 
 DROPIN_DIR="/usr/local/etc/monit.opnsense.d"
 
+# Move a freshly generated drop-in into place only if its content changed
+install_dropin() {
+    new_file="$1"
+    target="$DROPIN_DIR/$2"
+
+    if [ -f "$target" ] && cmp -s "$new_file" "$target"; then
+        rm -f "$new_file"
+        echo "Unchanged $2"
+    else
+        mv "$new_file" "$target"
+        echo "Generated $2"
+        changed=1
+    fi
+}
+
 configure() {
     mkdir -p "$DROPIN_DIR"
+    changed=0
 
     # === Generate OpenVPN monitors ===
-    cat > "$DROPIN_DIR/openvpn.conf" << EOF
+    tmp="$DROPIN_DIR/.openvpn.conf.tmp"
+    cat > "$tmp" << EOF
 # OpenVPN Instance Monitoring - Generated by Custom Config
 # Auto-restart crashed OpenVPN instances
 EOF
@@ -20,31 +37,40 @@ EOF
         uuid=$(basename "$conf" | sed "s/instance-//;s/.conf//")
         # Use short uuid for process name
         short_uuid=$(echo "$uuid" | cut -c1-8)
-        cat >> "$DROPIN_DIR/openvpn.conf" << EOF
+        # Prefer the instance's pidfile so monit does not scan the process table
+        pidfile=$(awk '$1 == "writepid" { print $2; exit }' "$conf")
+        if [ -n "$pidfile" ]; then
+            check="check process openvpn_${short_uuid} with pidfile \"$pidfile\""
+        else
+            check="check process openvpn_${short_uuid} matching \"$uuid\""
+        fi
+        cat >> "$tmp" << EOF
 
-check process openvpn_${short_uuid} matching "$uuid"
+$check
     start program = "/usr/local/sbin/openvpn --config $conf --daemon"
     stop program = "/usr/bin/pkill -f $uuid"
     if does not exist then restart
 EOF
     done
-    echo "Generated openvpn.conf"
+    install_dropin "$tmp" openvpn.conf
 
     # === Generate VPN Bypass Sniffer monitor ===
     # Note: Using nohup with test mode instead of daemon mode because Python's
     # os.fork() daemonization causes crashes on FreeBSD/OPNsense
-    cat > "$DROPIN_DIR/vpnbypass_sniffer.conf" << 'EOF'
+    tmp="$DROPIN_DIR/.vpnbypass_sniffer.conf.tmp"
+    cat > "$tmp" << 'EOF'
 # VPN Bypass DNS Sniffer Monitor - Generated by Custom Config
-check process vpnbypass_sniffer matching "vpnbypass_sniffer"
+check process vpnbypass_sniffer with pidfile "/var/run/vpnbypass_sniffer.pid"
     start program = "/bin/sh -c 'nohup /usr/local/bin/python3 /usr/local/opnsense/scripts/OPNsense/CustomConfig/vpnbypass_sniffer.py test > /var/log/vpnbypass_sniffer.log 2>&1 & echo $! > /var/run/vpnbypass_sniffer.pid'"
     stop program = "/bin/sh -c 'kill $(cat /var/run/vpnbypass_sniffer.pid 2>/dev/null) 2>/dev/null; rm -f /var/run/vpnbypass_sniffer.pid'"
     if does not exist then restart
     if 5 restarts within 5 cycles then alert
 EOF
-    echo "Generated vpnbypass_sniffer.conf"
+    install_dropin "$tmp" vpnbypass_sniffer.conf
 
     # === Generate Gateway Watcher monitor ===
-    cat > "$DROPIN_DIR/gateway_monitors.conf" << EOF
+    tmp="$DROPIN_DIR/.gateway_monitors.conf.tmp"
+    cat > "$tmp" << EOF
 # Gateway Watcher Monitor - Generated by Custom Config
 check process gateway_watcher matching "gateway_watcher.php"
     start program = "/usr/sbin/service dpinger restart" with timeout 30 seconds
@@ -52,12 +78,16 @@ check process gateway_watcher matching "gateway_watcher.php"
     if does not exist then restart
     if 5 restarts within 5 cycles then alert
 EOF
-    echo "Generated gateway_monitors.conf"
+    install_dropin "$tmp" gateway_monitors.conf
 
-    # Reload monit
+    # Reload monit only when a drop-in changed
     if pgrep -q monit; then
-        /usr/local/bin/monit reload 2>/dev/null
-        echo "Monit reloaded"
+        if [ "$changed" -eq 1 ]; then
+            /usr/local/bin/monit reload 2>/dev/null
+            echo "Monit reloaded"
+        else
+            echo "No changes, monit not reloaded"
+        fi
     else
         /usr/local/bin/monit 2>/dev/null
         echo "Monit started"
@@ -8,7 +8,12 @@ DOMAIN_FILE="/usr/local/etc/vpn_bypass_domains.conf"
 DISCOVERED_DOMAINS_FILE="/var/db/customconfig_vpnbypass_discovered.txt"
 TABLE_NAME="customconfig_vpnbypass"
 TEMP_FILE="/tmp/vpn_bypass_ips.tmp"
+SNAPSHOT_FILE="/var/db/customconfig_vpnbypass_snapshot.txt"
+# Snapshot entries not seen in the table for this long are not restored
+SNAPSHOT_MAX_AGE=86400
 CONFIG_XML="/conf/config.xml"
+SYNC_SCRIPT="/usr/local/opnsense/scripts/OPNsense/CustomConfig/vpnbypass_sync.py"
+SEED_SCRIPT="/usr/local/opnsense/scripts/OPNsense/CustomConfig/vpnbypass_seed.py"
 
 COMMON_SUBDOMAINS="www"
 
@@ -44,6 +49,9 @@ configure() {
     }
 
     if [ -f "$DOMAIN_FILE" ]; then
+        # Seed new wildcards from the Unbound cache before their zones are flushed
+        "$SEED_SCRIPT" || true
+
         # Build list of subdomains to add
         temp_subs="/tmp/vpnbypass_subs.tmp"
         > "$temp_subs"
@@ -143,6 +151,7 @@ update() {
         /sbin/pfctl -t "$TABLE_NAME" -T add -f "$TEMP_FILE" 2>/dev/null
         logger -t customconfig "VPN Bypass: Updated $TABLE_NAME with $ip_count IPs"
         echo "Updated PF table '$TABLE_NAME' with $ip_count IPs"
+        snapshot >/dev/null
     else
         echo "No IPs resolved from domains"
     fi
@@ -150,6 +159,47 @@ update() {
     rm -f "$TEMP_FILE"
 }
 
+# Save the table contents with a last-seen time per address, keeping
+# recently dropped entries until they exceed SNAPSHOT_MAX_AGE
+snapshot() {
+    now=$(date +%s)
+    tmp="${SNAPSHOT_FILE}.tmp"
+
+    /sbin/pfctl -t "$TABLE_NAME" -T show 2>/dev/null | awk -v now="$now" -v max="$SNAPSHOT_MAX_AGE" -v old="$SNAPSHOT_FILE" '
+        BEGIN {
+            while ((getline line < old) > 0) {
+                split(line, f, " ")
+                if (f[1] != "" && now - f[2] < max) seen[f[1]] = f[2]
+            }
+        }
+        { gsub(/[[:space:]]/, ""); if ($0 != "") seen[$0] = now }
+        END { for (ip in seen) print ip, seen[ip] }
+    ' | sort > "$tmp"
+
+    mv "$tmp" "$SNAPSHOT_FILE"
+    echo "Snapshot saved with $(wc -l < "$SNAPSHOT_FILE" | tr -d ' ') IPs"
+}
+
+# Bulk-load the last snapshot into the table (boot warm start)
+restore() {
+    if [ ! -s "$SNAPSHOT_FILE" ]; then
+        echo "No snapshot to restore"
+        return 0
+    fi
+
+    now=$(date +%s)
+    restore_file="/tmp/vpnbypass_restore.tmp"
+    awk -v now="$now" -v max="$SNAPSHOT_MAX_AGE" 'now - $2 < max { print $1 }' "$SNAPSHOT_FILE" > "$restore_file"
+
+    count=$(wc -l < "$restore_file" | tr -d ' ')
+    if [ "$count" -gt 0 ]; then
+        /sbin/pfctl -t "$TABLE_NAME" -T add -f "$restore_file" 2>/dev/null
+        logger -t customconfig "VPN Bypass: Restored $count IPs into $TABLE_NAME from snapshot"
+    fi
+    rm -f "$restore_file"
+    echo "Restored $count IPs from snapshot"
+}
+
 status() {
     echo "=== VPN Bypass Status ==="
     if /sbin/pfctl -t "$TABLE_NAME" -T show >/dev/null 2>&1; then
@@ -217,6 +267,7 @@ add_domain() {
         echo "Domain already in list: $domain"
     else
         echo "$domain" >> "$DISCOVERED_DOMAINS_FILE"
+        "$SYNC_SCRIPT" record domain "$domain" >/dev/null 2>&1
         echo "Added domain: $domain"
     fi
 
@@ -239,5 +290,7 @@ case "$1" in
     discovered) discovered ;;
     clear) clear_discovered ;;
     add) add_domain "$2" ;;
-    *) echo "Usage: $0 {configure|update|status|discovered|clear|add <domain>}"; exit 1 ;;
+    snapshot) snapshot ;;
+    restore) restore ;;
+    *) echo "Usage: $0 {configure|update|status|discovered|clear|add <domain>|snapshot|restore}"; exit 1 ;;
 esac
@@ -0,0 +1,215 @@
+#!/usr/local/bin/python3
+"""
+VPN Bypass Cache Seeding
+
+Streams the Unbound cache (unbound-control dump_cache) and picks out the
+names covered by newly added wildcards together with their A/AAAA records,
+following CNAME chains the way the sniffer attributes a response's
+addresses to the queried name. The names are added to the discovered list
+and the addresses to the PF table in one batch, so bypass is complete
+right away instead of waiting for clients to query each name again.
+
+vpnbypass.sh configure runs this before it flushes the wildcard zones from
+Unbound. Only wildcards not seeded before are processed; the list of
+seeded base domains is kept in SEEDED_FILE.
+
+Usage:
+    vpnbypass_seed.py [--dump FILE] [--dry-run] [--all] [base_domain ...]
+
+Options:
+    --dump FILE   read a saved dump_cache output instead of asking Unbound
+    --dry-run     print the names and addresses found, change nothing
+    --all         seed every configured wildcard, not only new ones
+    base_domain   seed these instead of the configured wildcards
+"""
+
+import os
+import subprocess
+import sys
+
+import vpnbypass_sync
+
+# File paths
+CONFIG_FILE = "/usr/local/etc/vpn_bypass_domains.conf"
+SEEDED_FILE = "/var/db/customconfig_vpnbypass_seeded.txt"
+UNBOUND_CONTROL = ["/usr/local/sbin/unbound-control", "-c", "/var/unbound/unbound.conf"]
+
+# Longest CNAME chain followed from a matching name
+MAX_CNAME_DEPTH = 8
+
+
+def configured_bases():
+    """Return the base domains of the *.domain wildcards in the config file"""
+    bases = []
+    try:
+        with open(CONFIG_FILE, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('*.'):
+                    bases.append(line[2:].lower().rstrip('.'))
+    except:
+        pass
+    return list(dict.fromkeys(bases))
+
+
+def load_seeded():
+    """Return the base domains seeded by earlier runs"""
+    try:
+        with open(SEEDED_FILE, 'r') as f:
+            return set(line.strip() for line in f if line.strip())
+    except:
+        return set()
+
+
+def save_seeded(bases):
+    """Remember the seeded bases (callers drop removed ones so they get reseeded when re-added)"""
+    with open(SEEDED_FILE + '.tmp', 'w') as f:
+        f.write(''.join(base + '\n' for base in sorted(bases)))
+    os.replace(SEEDED_FILE + '.tmp', SEEDED_FILE)
+
+
+def covered(name, bases):
+    """Return True if name is one of the bases or a subdomain of one"""
+    while True:
+        if name in bases:
+            return True
+        if '.' not in name:
+            return False
+        name = name.split('.', 1)[1]
+
+
+def parse_dump(lines, bases):
+    """
+    Scan dump_cache output for names under the given base domains.
+
+    Only the RRset section is read, one line at a time. Address and CNAME
+    records are kept until the stream ends because the dump is in hash
+    order, so a CNAME's target may come before or after it.
+    Returns (names, addresses) as ordered lists.
+    """
+    bases = set(bases)
+    names = {}
+    cnames = {}
+    addresses = {}
+    in_rrsets = False
+
+    for line in lines:
+        if line.startswith('START_RRSET_CACHE'):
+            in_rrsets = True
+            continue
+        if line.startswith('END_RRSET_CACHE'):
+            break
+        if not in_rrsets or line.startswith(';'):
+            continue
+
+        # owner TTL class type rdata
+        parts = line.split()
+        if len(parts) < 5 or parts[3] not in ('A', 'AAAA', 'CNAME'):
+            continue
+        owner = parts[0].rstrip('.').lower()
+        if parts[3] == 'CNAME':
+            cnames.setdefault(owner, parts[4].rstrip('.').lower())
+        else:
+            addresses.setdefault(owner, []).append(parts[4])
+        if owner not in names and covered(owner, bases):
+            names[owner] = True
+
+    found = {}
+    for name in names:
+        target = name
+        for _ in range(MAX_CNAME_DEPTH):
+            for address in addresses.get(target, []):
+                found[address] = True
+            if target not in cnames:
+                break
+            target = cnames[target]
+
+    return list(names), list(found)
+
+
+def dump_cache():
+    """Start unbound-control dump_cache and return the process"""
+    return subprocess.Popen(UNBOUND_CONTROL + ['dump_cache'], stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, text=True)
+
+
+def seed(lines, bases, state_dir=vpnbypass_sync.STATE_DIR, pf_add=vpnbypass_sync.pf_add_ips,
+         record=True):
+    """
+    Add the cached names and addresses under bases in one batch.
+
+    New names go to the discovered list, all found addresses are loaded
+    into the PF table with one pfctl call, and with record set both are
+    written to the HA delta log. Returns (names added, addresses loaded).
+    """
+    names, addresses = parse_dump(lines, bases)
+    added = vpnbypass_sync.append_domains(names, state_dir)
+    pf_add(addresses)
+    if record:
+        vpnbypass_sync.record_delta([('domain', d) for d in added] + [('ip', a) for a in addresses],
+                                    state_dir)
+    return added, addresses
+
+
+def main():
+    args = sys.argv[1:]
+    dump_file = None
+    dry_run = False
+    seed_all = False
+    bases = []
+
+    while args:
+        arg = args.pop(0)
+        if arg == '--dump' and args:
+            dump_file = args.pop(0)
+        elif arg == '--dry-run':
+            dry_run = True
+        elif arg == '--all':
+            seed_all = True
+        elif arg.startswith('-'):
+            print(__doc__)
+            sys.exit(1)
+        else:
+            bases.append(arg.lower().lstrip('*.').rstrip('.'))
+
+    configured = configured_bases()
+    seeded = load_seeded() & set(configured)
+    if not bases:
+        bases = configured if seed_all else [b for b in configured if b not in seeded]
+    if not bases:
+        print("No new wildcards to seed")
+        if not dry_run:
+            save_seeded(seeded)
+        return
+
+    proc = None
+    if dump_file:
+        stream = open(dump_file, 'r')
+    else:
+        proc = dump_cache()
+        stream = proc.stdout
+
+    with stream:
+        if dry_run:
+            names, addresses = parse_dump(stream, bases)
+            for name in names:
+                print(f"domain {name}")
+            for address in addresses:
+                print(f"ip {address}")
+        else:
+            names, addresses = seed(stream, bases, record=vpnbypass_sync.sync_enabled())
+    if proc and proc.wait() != 0:
+        # Leave the bases unseeded so the next configure tries again
+        print(f"unbound-control dump_cache failed (exit {proc.returncode})")
+        sys.exit(1)
+
+    if not dry_run:
+        # Only the bases processed now count as seeded, a manual run for
+        # some bases must not hide newly added wildcards from configure
+        save_seeded((seeded | set(bases)) & set(configured))
+        print(f"Seeded {len(names)} new domains and {len(addresses)} IPs "
+              f"from the Unbound cache for {', '.join(bases)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,10 @@ Usage:
     vpnbypass_sniffer.py stop    - Stop the sniffer daemon
     vpnbypass_sniffer.py status  - Check if daemon is running
     vpnbypass_sniffer.py test    - Run in foreground for testing
+
+Profiling (running daemon):
+    kill -USR1 <pid>  - Start/stop cProfile and per-stage timing, report in PROFILE_FILE
+    kill -USR2 <pid>  - Start/stop tracemalloc, report in MEMORY_FILE
 """
 
 import os
@@ -19,20 +23,98 @@ import time
 import signal
 import subprocess
 import fcntl
+import cProfile
+import io
+import pstats
+import tracemalloc
+import heapq
+import json
+import queue
+import tempfile
+import threading
 from datetime import datetime
 
+import configxml
+import vpnbypass_sync
+
 # File paths
 CONFIG_FILE = "/usr/local/etc/vpn_bypass_domains.conf"
 DISCOVERED_DOMAINS_FILE = "/var/db/customconfig_vpnbypass_discovered.txt"
+LASTSEEN_FILE = "/var/db/customconfig_vpnbypass_lastseen.txt"
 PID_FILE = "/var/run/vpnbypass_sniffer.pid"
 LOG_FILE = "/var/log/vpnbypass_sniffer.log"
 PF_TABLE = "customconfig_vpnbypass"
 
+# Discovered domain retention, overridden by the vpnbypass settings in config.xml
+DEFAULT_MAX_AGE_DAYS = 30
+DEFAULT_MAX_ENTRIES = 2000
+# Most domains evicted per maintenance pass, so eviction never stalls the loop
+EVICT_BATCH = 200
+
+# Ingest backpressure: capture and processing are decoupled by a bounded
+# queue; when it is full the oldest ("oldest") or incoming ("newest") line
+# is dropped
+QUEUE_SIZE = 2000
+QUEUE_DROP_POLICY = "oldest"
+
+# Token buckets (per second, burst). Responses to a client over its limit
+# are dropped; matches for a base domain over its limit are deferred and
+# added in one batch every DEFER_FLUSH_INTERVAL seconds
+CLIENT_RATE = 50
+CLIENT_BURST = 200
+DOMAIN_RATE = 20
+DOMAIN_BURST = 50
+DEFER_FLUSH_INTERVAL = 1
+DEFERRED_MAX = 5000
+
+# Ingest counters, refreshed every STATS_INTERVAL seconds
+STATS_FILE = "/var/run/vpnbypass_sniffer.stats.json"
+STATS_INTERVAL = 10
+
+# Binaries (overridable for replay/benchmark harnesses)
+PFCTL = "/sbin/pfctl"
+TCPDUMP = "/usr/sbin/tcpdump"
+
+# Profiling reports (written when the hooks are toggled off)
+PROFILE_FILE = "/var/run/vpnbypass_sniffer.profile.txt"
+MEMORY_FILE = "/var/run/vpnbypass_sniffer.memory.txt"
+PROFILE_TOP = 40
+MEMORY_TOP = 30
+
+# Pipeline stages timed while profiling: stage name -> function name
+PROFILE_STAGES = (
+    ('parse', 'parse_tcpdump_line'),
+    ('match', 'domain_matches_wildcard'),
+    ('pf_write', 'add_ip_to_table'),
+    ('pf_batch', 'add_ips_to_table'),
+)
+
 # Global state
 wildcard_patterns = []
 known_domains = set()
+domain_stats = {}
+stats_dirty = False
+max_age = DEFAULT_MAX_AGE_DAYS * 86400
+max_entries = DEFAULT_MAX_ENTRIES
+sync_active = False
 running = True
 tcpdump_proc = None
+profiler = None
+profile_started = None
+stage_timings = {}
+untimed_stages = {}
+memory_baseline = None
+line_queue = queue.Queue(QUEUE_SIZE)
+client_buckets = {}
+domain_buckets = {}
+deferred_domains = set()
+deferred_ips = set()
+counters = dict.fromkeys((
+    'received', 'processed', 'dropped_queue', 'dropped_client',
+    'deferred', 'dropped_deferred', 'deferred_added'), 0)
+
+# Client address of a response: "<server>.53 > <client>.<port>:"
+CLIENT_RE = re.compile(r'\.53 > ([0-9a-fA-F:.]+)\.\d+:')
 
 
 def log(msg, level="INFO"):
@@ -49,17 +131,12 @@ def log(msg, level="INFO"):
 
 def get_lan_interface():
     """Detect the LAN interface from OPNsense config"""
-    import xml.etree.ElementTree as ET
-
     try:
-        tree = ET.parse("/conf/config.xml")
-        root = tree.getroot()
-
-        # Find LAN interface name (e.g., "igb1")
-        lan_if = root.find(".//interfaces/lan/if")
-        if lan_if is not None and lan_if.text:
-            log(f"Detected LAN interface: {lan_if.text}")
-            return lan_if.text
+        # Streams config.xml once and caches the result by mtime/size
+        lan_if = configxml.get_lan_interface()
+        if lan_if:
+            log(f"Detected LAN interface: {lan_if}")
+            return lan_if
     except Exception as e:
         log(f"Error detecting LAN interface: {e}", "ERROR")
 
@@ -116,6 +193,110 @@ def load_known_domains():
             pass
 
     log(f"Loaded {len(known_domains)} known domains")
+    load_domain_stats()
+
+
+def load_retention():
+    """Load the discovered domain retention policy and HA sync state from config.xml"""
+    global max_age, max_entries, sync_active
+
+    sync_active = vpnbypass_sync.sync_enabled()
+
+    try:
+        settings = configxml.get_vpnbypass_settings()
+    except Exception as e:
+        log(f"Error loading retention settings: {e}", "ERROR")
+        settings = {}
+
+    try:
+        max_age = int(settings.get('discoveredmaxage') or DEFAULT_MAX_AGE_DAYS) * 86400
+    except ValueError:
+        max_age = DEFAULT_MAX_AGE_DAYS * 86400
+    try:
+        max_entries = int(settings.get('discoveredmaxentries') or DEFAULT_MAX_ENTRIES)
+    except ValueError:
+        max_entries = DEFAULT_MAX_ENTRIES
+
+
+def load_domain_stats():
+    """
+    Load last-seen time and hit count per known domain.
+
+    Domains without a record (discovered before tracking existed, or added
+    by vpnbypass.sh) start their retention period now.
+    """
+    global domain_stats, stats_dirty
+    saved = {}
+
+    try:
+        with open(LASTSEEN_FILE, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3:
+                    saved[parts[0]] = [float(parts[1]), int(parts[2])]
+    except:
+        pass
+
+    now = time.time()
+    domain_stats = {d: saved.get(d) or [now, 0] for d in known_domains}
+    stats_dirty = True
+
+
+def save_domain_stats():
+    """Atomically write the last-seen records"""
+    global stats_dirty
+
+    try:
+        with open(LASTSEEN_FILE + '.tmp', 'w') as f:
+            for domain, (last_seen, hits) in domain_stats.items():
+                f.write(f"{domain} {int(last_seen)} {hits}\n")
+        os.replace(LASTSEEN_FILE + '.tmp', LASTSEEN_FILE)
+        stats_dirty = False
+    except Exception as e:
+        log(f"Error saving domain stats: {e}", "ERROR")
+
+
+def evict_domains():
+    """
+    Forget up to EVICT_BATCH domains past max_age or beyond max_entries.
+
+    The least recently seen go first. They are dropped from the discovered
+    list, so the next update no longer re-resolves them; a domain that
+    shows up again is simply rediscovered.
+    """
+    global stats_dirty
+
+    now = time.time()
+    over = len(domain_stats) - max_entries if max_entries else 0
+    oldest = heapq.nsmallest(EVICT_BATCH, domain_stats.items(), key=lambda item: item[1][0])
+    evicted = [domain for i, (domain, (last_seen, hits)) in enumerate(oldest)
+               if i < over or (max_age and now - last_seen > max_age)]
+    if not evicted:
+        return 0
+
+    try:
+        remove = set(evicted)
+        with open(DISCOVERED_DOMAINS_FILE, 'r+') as f:
+            # Rewrite in place so appenders holding the lock keep the same file
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            keep = [line for line in f if line.strip().lower() not in remove]
+            f.seek(0)
+            f.writelines(keep)
+            f.truncate()
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    except FileNotFoundError:
+        # List was cleared, only the in-memory state needs updating
+        pass
+    except Exception as e:
+        log(f"Error evicting domains: {e}", "ERROR")
+        return 0
+
+    for domain in evicted:
+        known_domains.discard(domain)
+        del domain_stats[domain]
+    stats_dirty = True
+    log(f"Evicted {len(evicted)} discovered domains, {len(known_domains)} remain")
+    return len(evicted)
 
 
 def domain_matches_wildcard(domain):
@@ -132,6 +313,7 @@ def add_discovered_domain(domain):
     domain = domain.rstrip('.').lower()
 
     if domain in known_domains:
+        touch_domain(domain)
         return False
 
     try:
@@ -140,13 +322,27 @@ def add_discovered_domain(domain):
             f.write(domain + '\n')
             fcntl.flock(f.fileno(), fcntl.LOCK_UN)
         known_domains.add(domain)
+        touch_domain(domain)
         log(f"Discovered new domain: {domain}")
+        record_sync([('domain', domain)])
         return True
     except Exception as e:
         log(f"Error adding domain: {e}", "ERROR")
     return False
 
 
+def touch_domain(domain):
+    """Record a DNS answer for a tracked domain"""
+    global stats_dirty
+    stats = domain_stats.get(domain)
+    if stats:
+        stats[0] = time.time()
+        stats[1] += 1
+    else:
+        domain_stats[domain] = [time.time(), 1]
+    stats_dirty = True
+
+
 def add_ip_to_table(ip):
     """Add IP to PF table"""
     ip = ip.strip()
@@ -155,17 +351,49 @@ def add_ip_to_table(ip):
 
     try:
         result = subprocess.run(
-            ['/sbin/pfctl', '-t', PF_TABLE, '-T', 'add', ip],
+            [PFCTL, '-t', PF_TABLE, '-T', 'add', ip],
             capture_output=True, text=True, timeout=5
         )
         if 'added' in result.stderr.lower() or result.returncode == 0:
             log(f"Added IP to PF table: {ip}")
+            # Only replicate IPs that were not in the table yet ("1/1 addresses added")
+            if result.stderr.startswith('1/'):
+                record_sync([('ip', ip)])
             return True
     except Exception as e:
         log(f"Error adding IP {ip}: {e}", "ERROR")
     return False
 
 
+def add_ips_to_table(ips):
+    """Add a batch of IPs to the PF table with a single pfctl call"""
+    try:
+        with tempfile.NamedTemporaryFile('w', prefix='vpnbypass_sniffer.', suffix='.txt') as f:
+            f.write('\n'.join(ips) + '\n')
+            f.flush()
+            result = subprocess.run(
+                [PFCTL, '-t', PF_TABLE, '-T', 'add', '-f', f.name],
+                capture_output=True, text=True, timeout=30
+            )
+        log(f"Added {len(ips)} deferred IPs to PF table: {result.stderr.strip()}")
+        counters['deferred_added'] += len(ips)
+        if not result.stderr.startswith('0/'):
+            # pfctl only reports a count, replicate the whole batch
+            record_sync([('ip', ip) for ip in ips])
+    except Exception as e:
+        log(f"Error adding deferred IPs: {e}", "ERROR")
+
+
+def record_sync(entries):
+    """Append (type, value) entries to the HA delta log for replication to the peer"""
+    if not sync_active:
+        return
+    try:
+        vpnbypass_sync.record_delta(entries)
+    except Exception as e:
+        log(f"Error recording sync delta: {e}", "ERROR")
+
+
 def parse_tcpdump_line(line):
     """
     Parse tcpdump verbose output for DNS responses.
@@ -228,6 +456,10 @@ def process_dns_response(domain, ips):
 
     base_domain = domain_matches_wildcard(domain)
     if base_domain:
+        if not take_token(domain_buckets, base_domain, DOMAIN_RATE, DOMAIN_BURST):
+            defer_response(domain, ips)
+            return
+
         # This domain matches one of our wildcard patterns
         if add_discovered_domain(domain):
             log(f"New subdomain of {base_domain}: {domain} -> {ips}")
@@ -236,12 +468,122 @@ def process_dns_response(domain, ips):
             add_ip_to_table(ip)
 
 
+def take_token(buckets, key, rate, burst):
+    """Token bucket check, returns False when key is over its rate"""
+    now = time.monotonic()
+    bucket = buckets.get(key)
+    if bucket is None:
+        buckets[key] = [burst - 1, now]
+        return True
+
+    tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+    bucket[1] = now
+    if tokens < 1:
+        bucket[0] = tokens
+        return False
+    bucket[0] = tokens - 1
+    return True
+
+
+def prune_buckets(buckets, rate, burst):
+    """Forget buckets that have refilled completely (idle keys)"""
+    now = time.monotonic()
+    for key in [k for k, (tokens, last) in buckets.items()
+                if tokens + (now - last) * rate >= burst]:
+        del buckets[key]
+
+
+def defer_response(domain, ips):
+    """Queue a rate-limited match for the next batch, dropping it when full"""
+    if len(deferred_ips) >= DEFERRED_MAX:
+        counters['dropped_deferred'] += 1
+        return
+    deferred_domains.add(domain.rstrip('.').lower())
+    deferred_ips.update(ip.strip() for ip in ips if ip.strip())
+    counters['deferred'] += 1
+
+
+def flush_deferred():
+    """Add the deferred domains and all their IPs with a single pfctl call"""
+    if not deferred_domains and not deferred_ips:
+        return
+
+    for domain in deferred_domains:
+        add_discovered_domain(domain)
+    ips = sorted(deferred_ips)
+    deferred_domains.clear()
+    deferred_ips.clear()
+    if ips:
+        add_ips_to_table(ips)
+
+
+def save_counters():
+    """Atomically write the ingest counters for status and monitoring"""
+    stats = dict(counters, queued=line_queue.qsize(), deferred_pending=len(deferred_ips),
+                 updated=int(time.time()))
+    try:
+        with open(STATS_FILE + '.tmp', 'w') as f:
+            json.dump(stats, f)
+        os.replace(STATS_FILE + '.tmp', STATS_FILE)
+    except Exception as e:
+        log(f"Error saving counters: {e}", "ERROR")
+
+
+def start_tcpdump(cmd):
+    """Start tcpdump with line buffered text output"""
+    return subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1  # Line buffered
+    )
+
+
+def capture_lines(cmd):
+    """
+    Read tcpdump output into the bounded line queue (capture thread).
+
+    Only queueing happens here, so tcpdump's pipe keeps draining while the
+    main loop is busy; overflow is counted and handled per QUEUE_DROP_POLICY.
+    """
+    global tcpdump_proc
+
+    while running:
+        line = tcpdump_proc.stdout.readline()
+
+        if not line:
+            # Check if process died
+            if tcpdump_proc.poll() is not None and running:
+                log("tcpdump process died, restarting...", "WARN")
+                time.sleep(1)
+                tcpdump_proc = start_tcpdump(cmd)
+            continue
+
+        # Skip non-response lines (responses come FROM port 53)
+        if '.53 >' not in line:
+            continue
+
+        counters['received'] += 1
+        try:
+            line_queue.put_nowait(line)
+        except queue.Full:
+            counters['dropped_queue'] += 1
+            if QUEUE_DROP_POLICY == 'oldest':
+                try:
+                    line_queue.get_nowait()
+                    line_queue.put_nowait(line)
+                except (queue.Empty, queue.Full):
+                    pass
+
+
 def run_sniffer():
     """Main sniffer loop using tcpdump"""
     global running, tcpdump_proc
 
     log("Starting DNS sniffer...")
     load_wildcard_patterns()
+    load_retention()
     load_known_domains()
 
     if not wildcard_patterns:
@@ -254,7 +596,7 @@ def run_sniffer():
     # Start tcpdump on LAN interface, capturing DNS responses
     # -l: line buffered, -n: no DNS resolution, -v: verbose (shows DNS content)
     cmd = [
-        '/usr/sbin/tcpdump',
+        TCPDUMP,
         '-l',           # Line buffered output
         '-n',           # Don't resolve IPs to names
         '-v',           # Verbose - shows DNS response content
@@ -266,55 +608,195 @@ def run_sniffer():
     log(f"Running: {' '.join(cmd)}")
 
     try:
-        tcpdump_proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1  # Line buffered
-        )
+        tcpdump_proc = start_tcpdump(cmd)
+        capture = threading.Thread(target=capture_lines, args=(cmd,), daemon=True)
+        capture.start()
 
-        # Track when we last reloaded config
-        last_config_check = time.time()
+        # Track when we last reloaded config, flushed deferred work and saved counters
+        last_config_check = last_flush = last_stats = time.time()
         config_check_interval = 60  # Check for config changes every 60 seconds
+        reported = dict(counters)
 
         while running:
-            # Read line from tcpdump (with timeout via select would be better but this works)
-            line = tcpdump_proc.stdout.readline()
-
-            if not line:
-                # Check if process died
-                if tcpdump_proc.poll() is not None:
-                    log("tcpdump process died, restarting...", "WARN")
-                    time.sleep(1)
-                    tcpdump_proc = subprocess.Popen(
-                        cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True,
-                        bufsize=1
-                    )
-                continue
+            try:
+                line = line_queue.get(timeout=1)
+            except queue.Empty:
+                line = None
 
-            line = line.strip()
             if line:
-                domain, ips = parse_tcpdump_line(line)
-                if domain and ips:
-                    process_dns_response(domain, ips)
-
-            # Periodically reload config to pick up changes
-            if time.time() - last_config_check > config_check_interval:
+                client = CLIENT_RE.search(line)
+                if client and not take_token(client_buckets, client.group(1), CLIENT_RATE, CLIENT_BURST):
+                    counters['dropped_client'] += 1
+                else:
+                    counters['processed'] += 1
+                    domain, ips = parse_tcpdump_line(line.strip())
+                    if domain and ips:
+                        process_dns_response(domain, ips)
+
+            now = time.time()
+            if now - last_flush >= DEFER_FLUSH_INTERVAL:
+                flush_deferred()
+                last_flush = now
+
+            if now - last_stats >= STATS_INTERVAL:
+                save_counters()
+                pressure = {k: counters[k] - reported[k] for k in
+                            ('dropped_queue', 'dropped_client', 'dropped_deferred', 'deferred')
+                            if counters[k] != reported[k]}
+                if pressure:
+                    log(f"Ingest under pressure: {pressure}", "WARN")
+                reported = dict(counters)
+                last_stats = now
+
+            # Periodically reload config and apply the retention policy
+            if now - last_config_check > config_check_interval:
                 load_wildcard_patterns()
+                load_retention()
+                evict_domains()
+                if stats_dirty:
+                    save_domain_stats()
+                prune_buckets(client_buckets, CLIENT_RATE, CLIENT_BURST)
+                prune_buckets(domain_buckets, DOMAIN_RATE, DOMAIN_BURST)
                 last_config_check = time.time()
 
     except Exception as e:
         log(f"Sniffer error: {e}", "ERROR")
     finally:
+        flush_deferred()
+        save_counters()
+        if stats_dirty:
+            save_domain_stats()
         if tcpdump_proc:
             tcpdump_proc.terminate()
             tcpdump_proc.wait()
 
 
+def write_report(path, text):
+    """Atomically replace a report file"""
+    with open(path + '.tmp', 'w') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
+
+
+def timed_stage(stage, func):
+    """Wrap func so its calls accumulate into stage_timings[stage]"""
+    timing = stage_timings[stage]
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            timing[0] += 1
+            timing[1] += elapsed
+            if elapsed > timing[2]:
+                timing[2] = elapsed
+    return wrapper
+
+
+def start_profiling():
+    """
+    Enable cProfile and swap timed wrappers in for the pipeline stages.
+
+    The wrappers replace the module globals the loop calls, so nothing
+    runs on the hot path while profiling is off.
+    """
+    global profiler, profile_started
+
+    module = sys.modules[__name__]
+    for stage, name in PROFILE_STAGES:
+        stage_timings[stage] = [0, 0.0, 0.0]
+        untimed_stages[name] = getattr(module, name)
+        setattr(module, name, timed_stage(stage, untimed_stages[name]))
+
+    profile_started = time.time()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    log("Profiling started")
+
+
+def stop_profiling():
+    """Disable cProfile, restore the stages and write the report"""
+    global profiler
+
+    profiler.disable()
+    module = sys.modules[__name__]
+    for name, func in untimed_stages.items():
+        setattr(module, name, func)
+    untimed_stages.clear()
+
+    out = io.StringIO()
+    out.write(f"VPN Bypass Sniffer profile, {time.time() - profile_started:.1f}s\n\n")
+    out.write(f"{'stage':<10} {'calls':>10} {'total ms':>12} {'avg us':>10} {'max ms':>10}\n")
+    for stage, _ in PROFILE_STAGES:
+        calls, total, worst = stage_timings[stage]
+        avg = total / calls * 1000000 if calls else 0
+        out.write(f"{stage:<10} {calls:>10} {total * 1000:>12.1f} {avg:>10.1f} {worst * 1000:>10.1f}\n")
+    out.write("\n")
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP)
+    profiler = None
+
+    try:
+        write_report(PROFILE_FILE, out.getvalue())
+        log(f"Profiling stopped, report written to {PROFILE_FILE}")
+    except Exception as e:
+        log(f"Error writing profile report: {e}", "ERROR")
+
+
+def start_memory_trace():
+    """Start tracemalloc and keep a baseline snapshot to diff against"""
+    global memory_baseline
+    tracemalloc.start(10)
+    memory_baseline = tracemalloc.take_snapshot()
+    log("Memory tracing started")
+
+
+def stop_memory_trace():
+    """Snapshot, write top allocations and growth since the baseline, stop tracing"""
+    global memory_baseline
+
+    # Leave out the profiler's own allocations when both hooks are on
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, pstats.__file__),
+    ])
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    lines = [f"VPN Bypass Sniffer memory, current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB",
+             f"known_domains: {len(known_domains)}, wildcard_patterns: {len(wildcard_patterns)}",
+             "", "Top allocations:"]
+    lines += [f"  {stat}" for stat in snapshot.statistics('lineno')[:MEMORY_TOP]]
+    lines += ["", "Growth since tracing started:"]
+    lines += [f"  {stat}" for stat in snapshot.compare_to(memory_baseline, 'lineno')[:MEMORY_TOP]]
+    memory_baseline = None
+
+    try:
+        write_report(MEMORY_FILE, "\n".join(lines) + "\n")
+        log(f"Memory tracing stopped, report written to {MEMORY_FILE}")
+    except Exception as e:
+        log(f"Error writing memory report: {e}", "ERROR")
+
+
+def profile_signal_handler(signum, frame):
+    """Toggle profiling (SIGUSR1) or memory tracing (SIGUSR2)"""
+    try:
+        if signum == signal.SIGUSR1:
+            if profiler is None:
+                start_profiling()
+            else:
+                stop_profiling()
+        elif signum == signal.SIGUSR2:
+            if memory_baseline is None:
+                start_memory_trace()
+            else:
+                stop_memory_trace()
+    except Exception as e:
+        log(f"Error toggling profiling: {e}", "ERROR")
+
+
 def signal_handler(signum, frame):
     """Handle shutdown signals"""
     global running, tcpdump_proc
@@ -392,6 +874,8 @@ def start_daemon():
 
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGUSR1, profile_signal_handler)
+    signal.signal(signal.SIGUSR2, profile_signal_handler)
 
     run_sniffer()
 
@@ -434,6 +918,15 @@ def status():
         pid = read_pid()
         print(f"Sniffer is running (PID: {pid})")
 
+        try:
+            with open(STATS_FILE, 'r') as f:
+                stats = json.load(f)
+            print("\nIngest counters:")
+            for key in sorted(stats):
+                print(f"  {key}: {stats[key]}")
+        except:
+            pass
+
         # Show some stats
         try:
             with open(LOG_FILE, 'r') as f:
@@ -458,6 +951,8 @@ def test_mode():
 
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGUSR1, profile_signal_handler)
+    signal.signal(signal.SIGUSR2, profile_signal_handler)
 
     run_sniffer()
 
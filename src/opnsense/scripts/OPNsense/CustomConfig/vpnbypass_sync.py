@@ -0,0 +1,381 @@
+#!/usr/local/bin/python3
+"""
+VPN Bypass HA State Replication
+
+Keeps an append-only delta log of discovered domains and bypass IPs on the
+primary and replays it incrementally on the HA peer, so that after a CARP
+failover the backup starts with a warm customconfig_vpnbypass table
+instead of rebuilding it by re-resolution.
+
+Replication is opt-in ("Replicate to HA Peer" in the VPN bypass settings)
+and needs an HA sync peer (hasync/synchronizetoip). Callers only record
+entries while both are set (see sync_enabled()), so a firewall that does
+not push does not accumulate a log that nothing ever compacts.
+
+push reaches the peer over ssh as root with key based login, which
+OPNsense HA does not set up; the keys must be installed by hand. Push
+failures are logged to syslog since cron discards the output.
+
+Every delta entry carries a sequence number. The peer remembers the last
+sequence it applied, so an interrupted transfer resumes where it stopped.
+A new log starts with a random epoch; the peer stores it with its cursor
+and is told to start over whenever the primary's epoch differs, so a
+recreated log is never mistaken for a continuation of the old one.
+
+Delta log format (one entry per line):
+    epoch <id>
+    <seq> domain <name>
+    <seq> ip <address>
+
+Usage:
+    vpnbypass_sync.py record <domain|ip> <value> - Append an entry if HA sync is configured (primary)
+    vpnbypass_sync.py export <seq>              - Print entries after seq (primary)
+    vpnbypass_sync.py apply                     - Apply entries read from stdin (peer)
+    vpnbypass_sync.py seq                       - Print the last applied seq and epoch (peer)
+    vpnbypass_sync.py push <host>               - Send new entries to the peer over ssh
+    vpnbypass_sync.py compact                   - Drop superseded entries from the log
+"""
+
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import syslog
+import tempfile
+
+import configxml
+
+# File paths (relative to the state directory)
+STATE_DIR = "/var/db"
+DELTA_LOG = "customconfig_vpnbypass_delta.log"
+DISCOVERED_DOMAINS = "customconfig_vpnbypass_discovered.txt"
+CURSOR_FILE = "customconfig_vpnbypass_sync.json"
+PF_TABLE = "customconfig_vpnbypass"
+SCRIPT = "/usr/local/opnsense/scripts/OPNsense/CustomConfig/vpnbypass_sync.py"
+
+# Compact the delta log on push once it grows beyond this size
+DELTA_MAX_BYTES = 4 * 1024 * 1024
+
+ENTRY_TYPES = ('domain', 'ip')
+
+
+def last_seq(f):
+    """Return the sequence number of the last entry in an open delta log"""
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+        return 0
+    f.seek(max(0, size - 1024))
+    lines = f.read().splitlines()
+    for line in reversed(lines):
+        parts = line.split(b' ', 1)
+        if parts[0].isdigit():
+            return int(parts[0])
+    return 0
+
+
+def sync_enabled():
+    """Return True if replication is enabled and an HA sync peer is configured"""
+    try:
+        return configxml.get_vpnbypass_settings().get('hasyncpush') == '1' and \
+            configxml.get_hasync_peer() is not None
+    except:
+        return False
+
+
+def new_epoch():
+    """Return a fresh random log epoch"""
+    return os.urandom(8).hex()
+
+
+def delta_epoch(state_dir=STATE_DIR):
+    """Return the epoch of the delta log, or '' if there is none"""
+    try:
+        with open(os.path.join(state_dir, DELTA_LOG), 'r') as f:
+            parts = f.readline().split()
+    except OSError:
+        return ''
+    if len(parts) == 2 and parts[0] == 'epoch':
+        return parts[1]
+    return ''
+
+
+def record_delta(entries, state_dir=STATE_DIR):
+    """
+    Append (type, value) entries to the delta log with fresh sequence numbers.
+
+    The log is locked while the last sequence is read and the entries are
+    written, so the sniffer and the shell scripts can record concurrently.
+    """
+    entries = [(t, v.strip().lower()) for t, v in entries if t in ENTRY_TYPES and v.strip()]
+    if not entries:
+        return 0
+
+    path = os.path.join(state_dir, DELTA_LOG)
+    f = open(path, 'ab+')
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    while os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+        # compact() replaced the log while we waited for the lock
+        f.close()
+        f = open(path, 'ab+')
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    with f:
+        try:
+            seq = last_seq(f)
+            lines = []
+            if os.fstat(f.fileno()).st_size == 0:
+                lines.append(f"epoch {new_epoch()}\n")
+            for entry_type, value in entries:
+                seq += 1
+                lines.append(f"{seq} {entry_type} {value}\n")
+            f.seek(0, os.SEEK_END)
+            f.write(''.join(lines).encode())
+            f.flush()
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    return seq
+
+
+def read_delta(since, state_dir=STATE_DIR):
+    """Yield (seq, type, value) for every entry after since"""
+    path = os.path.join(state_dir, DELTA_LOG)
+    if not os.path.exists(path):
+        return
+    with open(path, 'r') as f:
+        for line in f:
+            entry = parse_entry(line)
+            if entry and entry[0] > since:
+                yield entry
+
+
+def parse_entry(line):
+    """Parse one delta line into (seq, type, value), or None if malformed"""
+    parts = line.split()
+    if len(parts) != 3 or not parts[0].isdigit() or parts[1] not in ENTRY_TYPES:
+        return None
+    return int(parts[0]), parts[1], parts[2]
+
+
+def compact(state_dir=STATE_DIR):
+    """
+    Rewrite the delta log keeping only the newest entry per (type, value).
+
+    Sequence numbers are preserved, so a peer that is part way through the
+    log still receives every value it has not seen yet.
+    """
+    path = os.path.join(state_dir, DELTA_LOG)
+    if not os.path.exists(path):
+        return 0
+
+    with open(path, 'rb+') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            newest = {}
+            epoch = None
+            for line in f.read().decode().splitlines():
+                if epoch is None and line.startswith('epoch '):
+                    epoch = line.split()[1]
+                entry = parse_entry(line)
+                if entry:
+                    newest[(entry[1], entry[2])] = entry[0]
+            entries = sorted((seq, t, v) for (t, v), seq in newest.items())
+
+            fd, tmp = tempfile.mkstemp(dir=state_dir, prefix='.' + DELTA_LOG + '.')
+            with os.fdopen(fd, 'w') as out:
+                # Sequence numbers are kept, so the epoch stays the same
+                out.write(f"epoch {epoch or new_epoch()}\n")
+                for seq, entry_type, value in entries:
+                    out.write(f"{seq} {entry_type} {value}\n")
+            os.replace(tmp, path)
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    return len(entries)
+
+
+def load_cursor(state_dir=STATE_DIR):
+    """Return (last sequence number applied on this node, its log epoch)"""
+    try:
+        with open(os.path.join(state_dir, CURSOR_FILE), 'r') as f:
+            cursor = json.load(f)
+        return cursor.get('seq', 0), cursor.get('epoch', '')
+    except:
+        return 0, ''
+
+
+def save_cursor(seq, epoch, state_dir=STATE_DIR):
+    """Atomically store the last applied sequence number and its epoch"""
+    path = os.path.join(state_dir, CURSOR_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'seq': seq, 'epoch': epoch}, f)
+    os.replace(path + '.tmp', path)
+
+
+def pf_add_ips(ips):
+    """Bulk-load IPs into the bypass PF table in one pfctl call, raising on failure"""
+    if not ips:
+        return
+    with tempfile.NamedTemporaryFile('w', prefix='vpnbypass_sync.', suffix='.txt') as f:
+        f.write('\n'.join(ips) + '\n')
+        f.flush()
+        result = subprocess.run(
+            ['/sbin/pfctl', '-t', PF_TABLE, '-T', 'add', '-f', f.name],
+            capture_output=True, text=True, timeout=30
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"pfctl failed: {result.stderr.strip() or result.returncode}")
+
+
+def append_domains(domains, state_dir=STATE_DIR):
+    """Append domains missing from the discovered list, returns the ones added"""
+    if not domains:
+        return []
+    path = os.path.join(state_dir, DISCOVERED_DOMAINS)
+    with open(path, 'a+') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        f.seek(0)
+        known = set(line.strip() for line in f if line.strip())
+        new = [d for d in dict.fromkeys(domains) if d not in known]
+        if new:
+            f.write('\n'.join(new) + '\n')
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    return new
+
+
+def apply_delta(lines, state_dir=STATE_DIR, pf_add=pf_add_ips):
+    """
+    Apply delta lines on the peer.
+
+    Entries at or below the stored cursor are skipped (a 'reset <epoch>'
+    line clears the cursor and adopts the new epoch first), new domains are
+    appended to the discovered list and new IPs are loaded into the PF
+    table in one batch. The cursor is advanced only after both succeeded;
+    a failing pf_add raises and leaves it where it was.
+    Returns the new cursor.
+    """
+    cursor, epoch = load_cursor(state_dir)
+    domains = []
+    ips = []
+    seq = cursor
+    reset = False
+
+    for line in lines:
+        parts = line.split()
+        if parts and parts[0] == 'reset':
+            # The primary's log is a different one, replay it from the beginning
+            cursor = seq = 0
+            epoch = parts[1] if len(parts) > 1 else ''
+            reset = True
+            continue
+        entry = parse_entry(line)
+        if not entry or entry[0] <= cursor:
+            continue
+        seq = max(seq, entry[0])
+        if entry[1] == 'domain':
+            domains.append(entry[2])
+        else:
+            ips.append(entry[2])
+
+    if seq == cursor and not reset:
+        return cursor
+
+    append_domains(domains, state_dir)
+    pf_add(list(dict.fromkeys(ips)))
+    save_cursor(seq, epoch, state_dir)
+    return seq
+
+
+class SshTransport:
+    """Reach the peer's vpnbypass_sync.py over ssh (key based, like HA admins use)"""
+
+    def __init__(self, host):
+        self.host = host
+
+    def run(self, args, data=None):
+        result = subprocess.run(
+            ['/usr/bin/ssh', '-o', 'BatchMode=yes', '-o', 'ConnectTimeout=10',
+             f'root@{self.host}', SCRIPT] + args,
+            input=data, capture_output=True, text=True, timeout=120
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or f'ssh exited {result.returncode}')
+        return result.stdout
+
+    def peer_cursor(self):
+        parts = self.run(['seq']).split()
+        return (int(parts[0]) if parts else 0), (parts[1] if len(parts) > 1 else '')
+
+    def send(self, lines):
+        return int(self.run(['apply'], ''.join(lines)).strip() or 0)
+
+
+class LocalTransport:
+    """Stand-in transport that applies to another state directory in-process"""
+
+    def __init__(self, state_dir, pf_add=None):
+        self.state_dir = state_dir
+        self.pf_add = pf_add or (lambda ips: None)
+
+    def peer_cursor(self):
+        return load_cursor(self.state_dir)
+
+    def send(self, lines):
+        return apply_delta(lines, self.state_dir, self.pf_add)
+
+
+def push(transport, state_dir=STATE_DIR):
+    """Send every entry the peer has not applied yet; returns the peer's new seq"""
+    path = os.path.join(state_dir, DELTA_LOG)
+    if os.path.exists(path) and os.path.getsize(path) > DELTA_MAX_BYTES:
+        compact(state_dir)
+
+    since, peer_epoch = transport.peer_cursor()
+    lines = []
+
+    epoch = delta_epoch(state_dir)
+    if epoch != peer_epoch:
+        # The peer followed another log (or none yet), make it start over
+        lines.append(f'reset {epoch}\n')
+        since = 0
+
+    lines += [f"{seq} {t} {v}\n" for seq, t, v in read_delta(since, state_dir)]
+    if not lines:
+        return since
+    return transport.send(lines)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    command = sys.argv[1]
+
+    if command == 'record' and len(sys.argv) == 4:
+        print(record_delta([(sys.argv[2], sys.argv[3])]) if sync_enabled() else 0)
+    elif command == 'export' and len(sys.argv) == 3:
+        for seq, entry_type, value in read_delta(int(sys.argv[2])):
+            print(f"{seq} {entry_type} {value}")
+    elif command == 'apply':
+        print(apply_delta(sys.stdin))
+    elif command == 'seq':
+        seq, epoch = load_cursor()
+        print(f"{seq} {epoch}")
+    elif command == 'push' and len(sys.argv) == 3:
+        try:
+            seq = push(SshTransport(sys.argv[2]))
+            print(f"Peer {sys.argv[2]} at seq {seq}")
+        except Exception as e:
+            print(f"Push to {sys.argv[2]} failed: {e}")
+            syslog.openlog('vpnbypass_sync')
+            syslog.syslog(syslog.LOG_ERR, f"Push to {sys.argv[2]} failed: {e}")
+            sys.exit(1)
+    elif command == 'compact':
+        print(f"Delta log compacted to {compact()} entries")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Cache seeding from a saved unbound-control dump_cache output.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'opnsense', 'scripts',
+                                'OPNsense', 'CustomConfig'))
+
+import vpnbypass_seed
+import vpnbypass_sync
+
+DUMP_FILE = os.path.join(os.path.dirname(__file__), 'data', 'unbound_dump_cache.txt')
+
+
+class SeedTest(unittest.TestCase):
+
+    def setUp(self):
+        state = tempfile.TemporaryDirectory()
+        self.addCleanup(state.cleanup)
+        self.state_dir = state.name
+        self.loaded = []
+
+    def read_state(self, name):
+        with open(os.path.join(self.state_dir, name)) as f:
+            return f.read().split()
+
+    def test_parse_dump_follows_cname_chains(self):
+        with open(DUMP_FILE) as f:
+            names, addresses = vpnbypass_seed.parse_dump(f, ['discover.com'])
+
+        # NS and other record types do not make a name bypassable
+        self.assertEqual(sorted(names), ['cards.discover.com', 'portal.discover.com'])
+        # The CNAME target comes before the CNAME in the dump and lies outside the base
+        self.assertEqual(sorted(addresses),
+                         ['192.0.2.20', '192.0.2.21', '2001:db8::20', '203.0.113.10'])
+
+    def test_parse_dump_ignores_other_bases_and_msg_cache(self):
+        with open(DUMP_FILE) as f:
+            names, addresses = vpnbypass_seed.parse_dump(f, ['unrelated.org'])
+        self.assertEqual((names, addresses), (['www.unrelated.org'], ['198.51.100.7']))
+
+    def test_seed_adds_names_and_addresses_once(self):
+        with open(DUMP_FILE) as f:
+            added, addresses = vpnbypass_seed.seed(f, ['discover.com'], self.state_dir,
+                                                   self.loaded.extend)
+        self.assertEqual(len(added), 2)
+        self.assertEqual(sorted(self.read_state(vpnbypass_sync.DISCOVERED_DOMAINS)), sorted(added))
+        self.assertEqual(self.loaded, addresses)
+        self.assertEqual(len(list(vpnbypass_sync.read_delta(0, self.state_dir))), 6)
+
+        with open(DUMP_FILE) as f:
+            added, _ = vpnbypass_seed.seed(f, ['discover.com'], self.state_dir, self.loaded.extend,
+                                           record=False)
+        self.assertEqual(added, [])
+        self.assertEqual(len(self.read_state(vpnbypass_sync.DISCOVERED_DOMAINS)), 2)
+
+
+class SeededStateTest(unittest.TestCase):
+
+    def setUp(self):
+        state = tempfile.TemporaryDirectory()
+        self.addCleanup(state.cleanup)
+        config_file = os.path.join(state.name, 'domains.conf')
+        with open(config_file, 'w') as f:
+            f.write('*.discover.com\n*.example.org\nplain.example.net\n')
+
+        self.seeded_calls = []
+        patches = {
+            'CONFIG_FILE': config_file,
+            'SEEDED_FILE': os.path.join(state.name, 'seeded.txt'),
+            'seed': lambda lines, bases, record=True: self.seeded_calls.append(bases) or ([], []),
+        }
+        for name, value in patches.items():
+            original = getattr(vpnbypass_seed, name)
+            setattr(vpnbypass_seed, name, value)
+            self.addCleanup(setattr, vpnbypass_seed, name, original)
+
+    def run_main(self, *args):
+        argv = sys.argv
+        sys.argv = ['vpnbypass_seed.py', '--dump', DUMP_FILE] + list(args)
+        try:
+            vpnbypass_seed.main()
+        finally:
+            sys.argv = argv
+
+    def test_manual_run_marks_only_its_bases(self):
+        self.run_main('discover.com')
+        self.assertEqual(vpnbypass_seed.load_seeded(), {'discover.com'})
+
+        # configure still seeds the wildcard the manual run did not cover
+        self.run_main()
+        self.assertEqual(self.seeded_calls, [['discover.com'], ['example.org']])
+        self.assertEqual(vpnbypass_seed.load_seeded(), {'discover.com', 'example.org'})
+
+    def test_removed_bases_are_forgotten(self):
+        vpnbypass_seed.save_seeded(['discover.com', 'example.org', 'removed.com'])
+        self.run_main()
+        self.assertEqual(self.seeded_calls, [])
+        self.assertEqual(vpnbypass_seed.load_seeded(), {'discover.com', 'example.org'})
+
+
+if __name__ == '__main__':
+    unittest.main()
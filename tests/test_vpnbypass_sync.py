@@ -0,0 +1,100 @@
+"""
+HA delta replication between two local state directories.
+
+The primary and the peer are temporary directories; LocalTransport applies
+the pushed entries in-process and a recording pf_add stands in for pfctl.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'opnsense', 'scripts',
+                                'OPNsense', 'CustomConfig'))
+
+import vpnbypass_sync
+
+
+class RecordingPf:
+    """pf_add stand-in that remembers the loaded IPs and can fail on demand"""
+
+    def __init__(self):
+        self.ips = []
+        self.failures = 0
+
+    def __call__(self, ips):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('pfctl failed: simulated')
+        self.ips.extend(ips)
+
+
+class SyncTest(unittest.TestCase):
+
+    def setUp(self):
+        primary = tempfile.TemporaryDirectory()
+        peer = tempfile.TemporaryDirectory()
+        self.addCleanup(primary.cleanup)
+        self.addCleanup(peer.cleanup)
+        self.primary = primary.name
+        self.peer = peer.name
+        self.pf = RecordingPf()
+        self.transport = vpnbypass_sync.LocalTransport(self.peer, self.pf)
+
+    def peer_domains(self):
+        path = os.path.join(self.peer, vpnbypass_sync.DISCOVERED_DOMAINS)
+        with open(path) as f:
+            return f.read().split()
+
+    def test_push_applies_new_entries_only(self):
+        vpnbypass_sync.record_delta([('domain', 'a.example.com'), ('ip', '192.0.2.1')], self.primary)
+        self.assertEqual(vpnbypass_sync.push(self.transport, self.primary), 2)
+
+        vpnbypass_sync.record_delta([('ip', '192.0.2.2')], self.primary)
+        self.assertEqual(vpnbypass_sync.push(self.transport, self.primary), 3)
+
+        self.assertEqual(self.peer_domains(), ['a.example.com'])
+        self.assertEqual(self.pf.ips, ['192.0.2.1', '192.0.2.2'])
+        seq, epoch = vpnbypass_sync.load_cursor(self.peer)
+        self.assertEqual((seq, epoch), (3, vpnbypass_sync.delta_epoch(self.primary)))
+
+    def test_interrupted_push_resumes(self):
+        vpnbypass_sync.record_delta([('domain', 'a.example.com'), ('ip', '192.0.2.1')], self.primary)
+        vpnbypass_sync.push(self.transport, self.primary)
+        vpnbypass_sync.record_delta([('ip', '192.0.2.2'), ('ip', '192.0.2.3')], self.primary)
+
+        self.pf.failures = 1
+        with self.assertRaises(RuntimeError):
+            vpnbypass_sync.push(self.transport, self.primary)
+        self.assertEqual(vpnbypass_sync.load_cursor(self.peer)[0], 2)
+
+        self.assertEqual(vpnbypass_sync.push(self.transport, self.primary), 4)
+        self.assertEqual(self.pf.ips, ['192.0.2.1', '192.0.2.2', '192.0.2.3'])
+
+    def test_new_epoch_replays_from_start(self):
+        vpnbypass_sync.record_delta([('ip', '192.0.2.1'), ('ip', '192.0.2.2')], self.primary)
+        vpnbypass_sync.push(self.transport, self.primary)
+        old_epoch = vpnbypass_sync.delta_epoch(self.primary)
+
+        # Recreated log: sequence numbers start over below the peer's cursor
+        os.remove(os.path.join(self.primary, vpnbypass_sync.DELTA_LOG))
+        vpnbypass_sync.record_delta([('ip', '198.51.100.1')], self.primary)
+        new_epoch = vpnbypass_sync.delta_epoch(self.primary)
+        self.assertNotEqual(new_epoch, old_epoch)
+
+        self.assertEqual(vpnbypass_sync.push(self.transport, self.primary), 1)
+        self.assertEqual(vpnbypass_sync.load_cursor(self.peer), (1, new_epoch))
+        self.assertEqual(self.pf.ips[-1], '198.51.100.1')
+
+    def test_compact_keeps_epoch_and_sequence(self):
+        vpnbypass_sync.record_delta([('ip', '192.0.2.1'), ('ip', '192.0.2.1'), ('ip', '192.0.2.2')],
+                                    self.primary)
+        epoch = vpnbypass_sync.delta_epoch(self.primary)
+        self.assertEqual(vpnbypass_sync.compact(self.primary), 2)
+        self.assertEqual(vpnbypass_sync.delta_epoch(self.primary), epoch)
+        self.assertEqual([e[0] for e in vpnbypass_sync.read_delta(0, self.primary)], [2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()